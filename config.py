@@ -2,7 +2,8 @@
 Configuration settings for Echoself AI
 """
 import os
-from pydantic_settings import BaseSettings
+from functools import lru_cache
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from typing import Optional
 
 class Settings(BaseSettings):
@@ -10,6 +11,7 @@ class Settings(BaseSettings):
     PUCH_AI_TOKEN: str = ""
     PUCH_AI_BASE_URL: str = "https://api.puch.ai/v1"
     PUCH_USER_PHONE: str = ""  # Your WhatsApp number
+    MAX_MEDIA_MB: int = 25  # Larger attachments are not downloaded
     
     # LLM Configuration (Gemini Pro)
     GEMINI_API_KEY: str = ""
@@ -19,15 +21,27 @@ class Settings(BaseSettings):
     QDRANT_URL: str = "http://localhost:6333"
     QDRANT_API_KEY: Optional[str] = None
     QDRANT_COLLECTION_NAME: str = "echoself_memories"
+    QDRANT_PREFER_GRPC: bool = False  # Opt in to gRPC; the server must expose QDRANT_GRPC_PORT
+    QDRANT_GRPC_PORT: int = 6334
     
     # Embedding Model
     EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
+    EMBEDDING_BACKEND: str = "torch"  # torch, onnx (requires optimum[onnxruntime])
+    EMBEDDING_ONNX_QUANTIZE: bool = False  # INT8 dynamic quantization for the ONNX graph
+    EMBEDDING_DTYPE: str = "float32"  # float32, or opt in to float16 (GPU) / bfloat16 (CPU autocast)
+    EMBEDDING_COMPILE: bool = False  # torch.compile the encoder (slower startup)
     
     # Whisper STT Configuration
     WHISPER_MODEL: str = "small"  # small, medium, large
+    WHISPER_BACKEND: str = "whispercpp"  # whispercpp (quantized GGML), openai
+    WHISPER_WORKERS: int = 2  # Transcription processes; CPU threads are split between them
+    WHISPER_LANGUAGE: str = "en"  # Spoken language code; empty to auto-detect per clip
     
     # Encryption
     ENCRYPTION_KEY: Optional[str] = None  # Will be generated if not provided
+    ENCRYPTION_KEY_FILE: str = "memory_key.json"  # Password-wrapped data key
+    USE_FASTPBKDF2: bool = False  # Requires the optional fastpbkdf2 package
+    BULK_MODE: bool = False  # Encrypt exports as a single AES-GCM blob
     
     # Storage
     DATA_DIR: str = "./data"
@@ -37,12 +51,25 @@ class Settings(BaseSettings):
     MCP_SERVER_HOST: str = "0.0.0.0"
     MCP_SERVER_PORT: int = 8086
     
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
+    # Settings never change after startup, so freeze them (also makes them hashable)
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        env_file_encoding="utf-8",
+        frozen=True,
+        validate_assignment=False
+    )
 
-# Global settings instance
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Build settings on first use and ensure the data directory exists"""
+    instance = Settings()
+    os.makedirs(instance.DATA_DIR, exist_ok=True)
+    return instance
+
+class _LazySettings:
+    """Proxy that defers reading the environment until a field is accessed"""
+    def __getattr__(self, name):
+        return getattr(get_settings(), name)
 
-# Ensure data directory exists
-os.makedirs(settings.DATA_DIR, exist_ok=True)
\ No newline at end of file
+# Global settings instance
+settings = _LazySettings()
@@ -0,0 +1,165 @@
+"""
+Embedding model backends for memory storage and search
+"""
+import os
+import logging
+from contextlib import ExitStack
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+ONNX_CACHE_DIR = os.path.expanduser("~/.cache/second_brain/onnx")
+
+class OnnxEmbedder:
+    """SentenceTransformer-compatible embedder running on ONNX Runtime"""
+
+    def __init__(self, model_name: str, cache_dir: str = ONNX_CACHE_DIR, quantize: bool = False, max_length: int = 256):
+        # Optional dependency: pip install optimum[onnxruntime]
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTOptimizer, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig, OptimizationConfig
+        from transformers import AutoTokenizer
+
+        model_id = model_name if '/' in model_name else f"sentence-transformers/{model_name}"
+        export_dir = os.path.join(cache_dir, model_id.replace('/', '__'))
+        file_name = "model_optimized_quantized.onnx" if quantize else "model_optimized.onnx"
+
+        if not os.path.exists(os.path.join(export_dir, file_name)):
+            # Export once, then reuse the optimized graph on later starts
+            logger.info(f"Exporting {model_id} to ONNX in {export_dir}")
+            model = ORTModelForFeatureExtraction.from_pretrained(model_id, export=True, provider='CPUExecutionProvider')
+            ORTOptimizer.from_pretrained(model).optimize(
+                save_dir=export_dir,
+                optimization_config=OptimizationConfig(optimization_level=99)
+            )
+            if quantize:
+                ORTQuantizer.from_pretrained(export_dir, file_name="model_optimized.onnx").quantize(
+                    save_dir=export_dir,
+                    quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+                )
+            AutoTokenizer.from_pretrained(model_id).save_pretrained(export_dir)
+
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            export_dir,
+            file_name=file_name,
+            provider='CPUExecutionProvider'
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        self.max_length = max_length
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.config.hidden_size
+
+    def encode(self, texts: List[str], batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, show_progress_bar: bool = False) -> np.ndarray:
+        """Mean-pooled sentence embeddings, matching SentenceTransformer.encode"""
+        # Longest-first by characters, as SentenceTransformer does, so each
+        # mini-batch pads to similar lengths without a separate tokenizer pass
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        ordered_texts = [texts[i] for i in order]
+
+        batches = []
+        for start in range(0, len(ordered_texts), batch_size):
+            inputs = self.tokenizer(
+                ordered_texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors='np'
+            )
+            token_embeddings = np.asarray(self.model(**inputs).last_hidden_state)
+
+            # Mean pooling over non-padding tokens
+            mask = inputs['attention_mask'][..., None].astype(np.float32)
+            embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+            if normalize_embeddings:
+                embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+            batches.append(embeddings.astype(np.float32))
+
+        if not batches:
+            return np.empty((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        # Scatter back to the caller's order
+        embeddings = np.empty((len(texts), batches[0].shape[1]), dtype=np.float32)
+        embeddings[order] = np.concatenate(batches)
+        return embeddings
+
+@lru_cache(maxsize=1)
+def resolve_embedding_dtype() -> str:
+    """EMBEDDING_DTYPE, falling back to float32 unless half precision is requested and usable"""
+    dtype = settings.EMBEDDING_DTYPE
+    if dtype == "float16" and not torch.cuda.is_available():
+        logger.warning("float16 embeddings need a GPU, using float32")
+        return "float32"
+    if dtype in ("float16", "bfloat16"):
+        return dtype
+    return "float32"
+
+def inference_context(model) -> ExitStack:
+    """Context for encode calls: no autograd, plus bfloat16 autocast when enabled"""
+    stack = ExitStack()
+    if isinstance(model, SentenceTransformer):
+        stack.enter_context(torch.inference_mode())
+        if resolve_embedding_dtype() == "bfloat16" and model.device.type == "cpu":
+            stack.enter_context(torch.autocast(device_type="cpu", dtype=torch.bfloat16))
+    return stack
+
+def encode_embeddings(model, texts: List[str], **kwargs) -> np.ndarray:
+    """Encode texts under inference_context, always returning float32 numpy arrays"""
+    with inference_context(model):
+        if isinstance(model, SentenceTransformer) and resolve_embedding_dtype() != "float32":
+            # Older sentence-transformers call .numpy() on half tensors, which fails for bfloat16
+            embeddings = model.encode(texts, convert_to_tensor=True, **kwargs)
+            return embeddings.float().cpu().numpy()
+        return model.encode(texts, convert_to_numpy=True, **kwargs)
+
+def _prepare_torch_model(model: SentenceTransformer) -> SentenceTransformer:
+    """Switch the PyTorch embedder to inference mode with fused attention"""
+    model.eval()
+
+    if resolve_embedding_dtype() == "float16" and model.device.type == "cuda":
+        model.half()
+
+    transformer = model._first_module()
+    try:
+        # Routes attention through F.scaled_dot_product_attention
+        transformer.auto_model = transformer.auto_model.to_bettertransformer()
+    except Exception as e:
+        logger.info(f"BetterTransformer not applied, using default attention: {e}")
+
+    if settings.EMBEDDING_COMPILE:
+        _compile_model(model)
+    return model
+
+def _compile_model(model: SentenceTransformer):
+    """torch.compile the encoder forward and trace the common shape buckets"""
+    transformer = model._first_module()
+    original = transformer.auto_model
+    try:
+        transformer.auto_model = torch.compile(original, mode="reduce-overhead", dynamic=True)
+        # Warm up short-message and long-message shapes so requests don't pay for tracing
+        with inference_context(model):
+            model.encode(["warmup"], show_progress_bar=False)
+            model.encode([" ".join(["warmup"] * 126)], show_progress_bar=False)
+    except Exception as e:
+        transformer.auto_model = original
+        logger.warning(f"torch.compile failed, using eager embedder: {e}")
+
+def load_embedding_model(model_name: str = None):
+    """Load the configured embedding backend, falling back to PyTorch"""
+    model_name = model_name or settings.EMBEDDING_MODEL
+
+    if settings.EMBEDDING_BACKEND == "onnx":
+        try:
+            return OnnxEmbedder(model_name, quantize=settings.EMBEDDING_ONNX_QUANTIZE)
+        except Exception as e:
+            logger.warning(f"ONNX embedding backend unavailable, using PyTorch: {e}")
+
+    return _prepare_torch_model(SentenceTransformer(model_name))
@@ -3,11 +3,56 @@ Encryption utilities for secure memory storage
 """
 import os
 import base64
+import hashlib
+import hmac
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from typing import Union
-import json
+from functools import lru_cache
+from typing import List, Optional, Tuple, Union
+import logging
+import orjson
+
+from config import settings
+
+try:
+    import fastpbkdf2  # Optional OpenMP/SIMD-accelerated PBKDF2
+except ImportError:
+    fastpbkdf2 = None
+
+try:
+    import keyring  # Optional OS keychain for the derived key
+except ImportError:
+    keyring = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SALT = b'echoself_salt_2024'  # In production, use random salt
+PBKDF2_ITERATIONS = 100000
+
+# Fernet tokens start with the base64 of version byte 0x80; tokens written
+# before the outer base64 layer was dropped start with the base64 of that
+LEGACY_TOKEN_PREFIX = 'Z0FBQUFB'
+
+KEYRING_SERVICE = "echoself"
+KEYRING_USERNAME = "memory_key"  # Suffixed per key file and salt
+
+@lru_cache(maxsize=1024)
+def _derive_key(password: str, salt: bytes, iterations: int) -> bytes:
+    """Derive a urlsafe-b64 Fernet key from a password (memoized per process)"""
+    if settings.USE_FASTPBKDF2 and fastpbkdf2 is not None:
+        raw_key = fastpbkdf2.pbkdf2_hmac('sha256', password.encode(), salt, iterations, 32)
+        return base64.urlsafe_b64encode(raw_key)
+    
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=iterations,
+    )
+    return base64.urlsafe_b64encode(kdf.derive(password.encode()))
 
 class MemoryEncryption:
     def __init__(self, password: str = None):
@@ -16,52 +61,187 @@ class MemoryEncryption:
             self.key = Fernet.generate_key()
         else:
             # Derive key from password
-            salt = b'echoself_salt_2024'  # In production, use random salt
-            kdf = PBKDF2HMAC(
-                algorithm=hashes.SHA256(),
-                length=32,
-                salt=salt,
-                iterations=100000,
-            )
-            key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
-            self.key = key
+            self.key = _derive_key(password, DEFAULT_SALT, PBKDF2_ITERATIONS)
         
         self.cipher_suite = Fernet(self.key)
     
-    def encrypt_data(self, data: Union[str, dict]) -> str:
-        """Encrypt data and return base64 encoded string"""
+    def encrypt_data(self, data: Union[str, bytes, dict]) -> str:
+        """Encrypt data and return the Fernet token as a string"""
         if isinstance(data, dict):
-            data = json.dumps(data)
+            data = orjson.dumps(data)
+        elif isinstance(data, str):
+            data = data.encode('utf-8')
         
-        encrypted_data = self.cipher_suite.encrypt(data.encode())
-        return base64.urlsafe_b64encode(encrypted_data).decode()
+        return self.cipher_suite.encrypt(data).decode('ascii')
     
-    def decrypt_data(self, encrypted_data: str) -> str:
-        """Decrypt base64 encoded string and return original data"""
+    def _decrypt_bytes(self, encrypted_data: str) -> bytes:
+        """Decrypt a Fernet token string and return the raw plaintext"""
         try:
-            encrypted_bytes = base64.urlsafe_b64decode(encrypted_data.encode())
-            decrypted_data = self.cipher_suite.decrypt(encrypted_bytes)
-            return decrypted_data.decode()
+            encrypted_data = migrate_legacy_token(encrypted_data)
+            return self.cipher_suite.decrypt(encrypted_data.encode('ascii'))
         except Exception as e:
             raise ValueError(f"Failed to decrypt data: {e}")
     
+    def decrypt_data(self, encrypted_data: str) -> str:
+        """Decrypt a Fernet token string and return original data"""
+        return self._decrypt_bytes(encrypted_data).decode('utf-8')
+    
     def encrypt_json(self, data: dict) -> str:
         """Encrypt JSON data"""
-        return self.encrypt_data(json.dumps(data))
+        return self.encrypt_data(orjson.dumps(data))
     
     def decrypt_json(self, encrypted_data: str) -> dict:
         """Decrypt and parse JSON data"""
-        decrypted_str = self.decrypt_data(encrypted_data)
-        return json.loads(decrypted_str)
+        return orjson.loads(self._decrypt_bytes(encrypted_data))
+    
+    def _bulk_cipher(self) -> AESGCM:
+        """AES-256-GCM cipher keyed by a subkey of the Fernet key"""
+        if getattr(self, '_aesgcm', None) is None:
+            subkey = HKDF(
+                algorithm=hashes.SHA256(),
+                length=32,
+                salt=None,
+                info=b'echoself-bulk',
+            ).derive(base64.urlsafe_b64decode(self.key))
+            self._aesgcm = AESGCM(subkey)
+        return self._aesgcm
+    
+    def encrypt_bulk(self, records: List[dict]) -> bytes:
+        """Encrypt many records in one AES-GCM pass (nonce + ciphertext)"""
+        nonce = os.urandom(12)
+        payload = orjson.dumps(records)
+        return nonce + self._bulk_cipher().encrypt(nonce, payload, None)
+    
+    def decrypt_bulk(self, blob: bytes) -> List[dict]:
+        """Decrypt records produced by encrypt_bulk"""
+        try:
+            payload = self._bulk_cipher().decrypt(blob[:12], blob[12:], None)
+            return orjson.loads(payload)
+        except Exception as e:
+            raise ValueError(f"Failed to decrypt bulk data: {e}")
     
     def get_key_string(self) -> str:
         """Get the encryption key as a string for storage"""
         return base64.urlsafe_b64encode(self.key).decode()
     
     @classmethod
-    def from_key_string(cls, key_string: str):
-        """Create encryption instance from key string"""
+    def from_key(cls, key: bytes):
+        """Create encryption instance from an already-derived Fernet key"""
         instance = cls.__new__(cls)
-        instance.key = base64.urlsafe_b64decode(key_string.encode())
+        instance.key = key
         instance.cipher_suite = Fernet(instance.key)
-        return instance
\ No newline at end of file
+        return instance
+    
+    @classmethod
+    def from_key_string(cls, key_string: str):
+        """Create encryption instance from key string"""
+        return cls.from_key(base64.urlsafe_b64decode(key_string.encode()))
+    
+    def wrap_key(self, password: str, salt: bytes) -> str:
+        """Encrypt the data key with a password-derived key-encryption key"""
+        kek = _derive_key(password, salt, PBKDF2_ITERATIONS)
+        return Fernet(kek).encrypt(self.key).decode()
+    
+    @classmethod
+    def unlock(cls, password: str, salt: bytes, wrapped_key_blob: str):
+        """Create encryption instance by unwrapping a password-protected data key"""
+        kek = _derive_key(password, salt, PBKDF2_ITERATIONS)
+        try:
+            key = Fernet(kek).decrypt(wrapped_key_blob.encode())
+        except Exception as e:
+            raise ValueError(f"Failed to unlock encryption key: {e}")
+        
+        return cls.from_key(key)
+
+def migrate_legacy_token(encrypted_data: str) -> str:
+    """Strip the redundant outer base64 layer from previously stored tokens"""
+    if encrypted_data.startswith(LEGACY_TOKEN_PREFIX):
+        return base64.urlsafe_b64decode(encrypted_data.encode('ascii')).decode('ascii')
+    return encrypted_data
+
+def _keyring_enabled() -> bool:
+    """Whether the OS keychain may be used to cache the data key"""
+    return keyring is not None and os.environ.get("ECHOSELF_SKIP_KEYRING") != "1"
+
+def _keyring_entry(password: str, key_file: str, data: dict) -> Tuple[str, str]:
+    """Keychain username and check value for the data key wrapped in key_file"""
+    # Per key file and salt, so separate instances and re-provisioned files
+    # don't share an entry; the check binds the cached key to its password
+    salt = base64.urlsafe_b64decode(data['salt'].encode())
+    username = hashlib.blake2b(os.path.abspath(key_file).encode() + b'\0' + salt, digest_size=16).hexdigest()
+    check = hashlib.blake2b(password.encode() + b'\0' + data['wrapped_key'].encode(), digest_size=16).hexdigest()
+    return f"{KEYRING_USERNAME}:{username}", check
+
+def _load_keyring_key(username: str, check: str) -> Optional[MemoryEncryption]:
+    """Restore the data key from the OS keychain, if one was stored for this key file and password"""
+    if not _keyring_enabled():
+        return None
+    try:
+        entry = keyring.get_password(KEYRING_SERVICE, username)
+        if not entry:
+            return None
+        cached = orjson.loads(entry)
+        # A changed password or wrapped key means the cached key is stale
+        if not hmac.compare_digest(cached['check'], check):
+            return None
+        return MemoryEncryption.from_key_string(cached['key'])
+    except Exception as e:
+        logger.warning(f"Could not read encryption key from keyring: {e}")
+        return None
+
+def _store_keyring_key(username: str, check: str, encryption: MemoryEncryption):
+    """Store the data key in the OS keychain so later starts skip the KDF"""
+    if not _keyring_enabled():
+        return
+    try:
+        entry = orjson.dumps({'key': encryption.get_key_string(), 'check': check}).decode()
+        keyring.set_password(KEYRING_SERVICE, username, entry)
+    except Exception as e:
+        logger.warning(f"Could not store encryption key in keyring: {e}")
+
+def load_encryption(password: str = None, key_file: str = None) -> MemoryEncryption:
+    """Unlock the stored data key, provisioning it on first use"""
+    if password is None or key_file is None:
+        return MemoryEncryption(password)
+    
+    if os.path.exists(key_file):
+        with open(key_file, 'rb') as f:
+            data = orjson.loads(f.read())
+        username, check = _keyring_entry(password, key_file, data)
+        cached = _load_keyring_key(username, check)
+        if cached is not None:
+            return cached
+        salt = base64.urlsafe_b64decode(data['salt'].encode())
+        encryption = MemoryEncryption.unlock(password, salt, data['wrapped_key'])
+    else:
+        encryption, data = _provision(password, key_file)
+        username, check = _keyring_entry(password, key_file, data)
+    
+    _store_keyring_key(username, check, encryption)
+    return encryption
+
+def _provision(password: str, key_file: str) -> Tuple[MemoryEncryption, dict]:
+    """Write key_file on first use, returning the data key and the file contents"""
+    # First-time provisioning keeps the password-derived key so existing
+    # ciphertexts stay readable
+    encryption = MemoryEncryption(password)
+    salt = os.urandom(16)
+    data = {
+        'salt': base64.urlsafe_b64encode(salt).decode(),
+        'wrapped_key': encryption.wrap_key(password, salt)
+    }
+    _write_key_file(key_file, orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    return encryption, data
+
+def _write_key_file(key_file: str, contents: bytes):
+    """Atomically write the key file, readable only by its owner"""
+    # A torn key file would make every stored memory undecryptable
+    temp_path = f"{key_file}.tmp"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    if hasattr(os, 'fchmod'):
+        os.fchmod(fd, 0o600)  # A temp file left by an earlier crash keeps its old mode
+    with os.fdopen(fd, 'wb') as f:
+        f.write(contents)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, key_file)
\ No newline at end of file
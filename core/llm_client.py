@@ -1,34 +1,153 @@
 """
 LLM client for generating reflections and summaries using Gemini Pro
 """
+import asyncio
 import google.generativeai as genai
+import hashlib
 import logging
-from typing import List, Dict, Optional
+import numpy as np
+import orjson
+import re
+from cachetools import TTLCache
+from functools import lru_cache
+from typing import AsyncIterator, Callable, List, Dict, Optional
 from datetime import datetime
 
 from config import settings
+from core.embedding_backend import encode_embeddings
+from core.sentiment_analyzer import get_sentiment_analyzer
 
 logger = logging.getLogger(__name__)
 
-class LLMClient:
-    def __init__(self):
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel(settings.GEMINI_MODEL)
-    
-    async def generate_reflection(self, query: str, memories: List[Dict]) -> str:
-        """Generate a reflective response based on query and retrieved memories"""
-        try:
-            # Prepare context from memories
-            memory_context = ""
-            for i, memory in enumerate(memories[:5], 1):  # Limit to top 5 memories
-                timestamp = memory.get('timestamp', 'Unknown time')
-                content = memory.get('content', '')
-                mood = memory.get('sentiment_analysis', {}).get('mood', 'neutral')
-                
-                memory_context += f"\nMemory {i} ({timestamp}, mood: {mood}):\n{content}\n"
-            
-            # Create reflection prompt
-            prompt = f"""You are Echoself AI, a reflective personal companion. A user has asked: "{query}"
+# Reflection context limits
+MEMORY_CONTENT_LIMIT = 300  # Characters of each memory sent to Gemini
+DUPLICATE_SIMILARITY = 0.95  # Cosine similarity above which memories are dropped
+
+# Labeled examples for the local intent classifier
+INTENT_EXAMPLES = {
+    'reflection_request': [
+        "Why do I keep feeling this way?",
+        "What patterns do you notice in my week?",
+        "Help me reflect on what happened with my family",
+        "What have I been thinking about lately?",
+        "Can you give me some insight into my stress?",
+        "Looking back, how have I changed this month?",
+        "What does it say about me that I avoid conflict?",
+        "What did I learn from my last job?",
+        "How has my sleep been affecting my mood?",
+        "What do my memories say about my friendships?",
+        "Am I happier now than I was last year?",
+        "Why do Mondays always feel so hard for me?",
+        "What seems to trigger my anxiety?",
+        "Help me understand why I reacted that way",
+        "What have I been grateful for recently?",
+        "Have I been making progress on my goals?",
+        "What do I usually do when I'm stressed?",
+        "Summarize what's been on my mind this week",
+        "Is there something I keep coming back to?",
+        "What can I learn from how the trip went?",
+    ],
+    'mood_check': [
+        "I'm feeling really down today",
+        "So happy right now!",
+        "I feel anxious and can't focus",
+        "Feeling pretty calm this evening",
+        "I'm exhausted and a bit sad",
+        "Honestly I'm frustrated and angry",
+        "Today I feel great",
+        "I'm nervous about tomorrow",
+        "I feel lonely tonight",
+        "Everything is going wrong and I'm upset",
+        "Pretty content with how today went",
+        "I'm overwhelmed with everything on my plate",
+        "Feeling grateful and relaxed",
+        "I'm so excited I can't sleep",
+        "Kind of bored and restless",
+        "My heart is heavy today",
+        "I feel proud of myself",
+        "I'm stressed out about exams",
+        "Just feeling meh",
+        "I'm irritated by everyone today",
+    ],
+    'memory_storage': [
+        "Today I went hiking with Sam and saw a waterfall",
+        "Had dinner with my parents, we talked about college",
+        "Just finished reading a book about habits",
+        "I got the job offer I interviewed for last week",
+        "Remember that my favourite cafe is on 5th street",
+        "We celebrated my sister's birthday at the beach",
+        "I tried meditation for the first time this morning",
+        "Note to self: the project deadline moved to Friday",
+        "Met an old friend at the station and we caught up for an hour",
+        "My manager praised my presentation in the team meeting",
+        "Cooked pasta from scratch for the first time",
+        "We adopted a puppy and named her Luna",
+        "Went to a concert last night, the band was amazing",
+        "Started learning Spanish on my commute",
+        "I ran 5k without stopping today",
+        "The doctor said my blood tests look fine",
+        "Moved into the new apartment this weekend",
+        "Had a long talk with my partner about moving cities",
+        "Finished the first draft of my essay",
+        "Watched the sunrise from the rooftop",
+    ],
+    'reminder_request': [
+        "Remind me to call mom tomorrow at 9am",
+        "Set a reminder for my dentist appointment next Monday",
+        "Can you remind me in 2 hours to take my medicine?",
+        "Don't let me forget to pay rent on the 1st",
+        "Remind me tonight to water the plants",
+        "Set an alarm to stretch every afternoon",
+        "Ping me next week about the report",
+        "Remind me to buy groceries after work",
+        "Set a reminder to renew my passport next month",
+        "Remind me at 6pm to start cooking",
+        "Please remind me about the meeting on Thursday",
+        "Can you remind me to send the invoice Friday morning?",
+        "Remind me in 30 minutes to check the oven",
+        "Set a reminder for Dad's birthday on June 5",
+        "Remind me tomorrow to follow up with the landlord",
+        "Remind me every Sunday to plan the week",
+        "Don't let me forget my keys when I leave",
+        "Remind me to book flights this weekend",
+        "Set a reminder to take out the trash tonight",
+        "Remind me next Tuesday to call the bank",
+    ],
+    'general_chat': [
+        "Hi",
+        "Hello there",
+        "Thanks!",
+        "ok",
+        "How are you?",
+        "Good morning",
+        "What can you do?",
+        "Tell me a joke",
+        "Hey",
+        "Good night",
+        "Thank you so much",
+        "Who are you?",
+        "lol",
+        "Nice",
+        "What's up?",
+        "See you later",
+        "Cool, got it",
+        "Are you there?",
+        "How does this work?",
+        "Bye",
+    ],
+}
+INTENT_MIN_SIMILARITY = 0.5  # Below this the Gemini classifier is used
+
+# Outermost JSON object in a model reply, ignoring any ``` fences around it
+JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+# Prompt templates, filled with str.format
+# Shown when Gemini can't produce a reflection
+REFLECTION_FALLBACK = "I'm having trouble processing your reflection right now. Please try again later."
+
+MEMORY_CONTEXT_ENTRY = "\nMemory {index} ({timestamp}, mood: {mood}):\n{content}\n"
+
+REFLECTION_PROMPT = """You are Echoself AI, a reflective personal companion. A user has asked: "{query}"
 
 Based on their personal memories below, provide a thoughtful, empathetic reflection that:
 1. Acknowledges their feelings and experiences
@@ -41,24 +160,14 @@ Personal Memories:
 
 Please respond as their caring AI companion, helping them reflect on their experiences and emotions."""
 
-            response = self.model.generate_content(prompt)
-            return response.text
-            
-        except Exception as e:
-            logger.error(f"Error generating reflection: {e}")
-            return "I'm having trouble processing your reflection right now. Please try again later."
-    
-    async def generate_mood_summary(self, mood_data: Dict, timeframe: str = "recent") -> str:
-        """Generate a mood summary report"""
-        try:
-            prompt = f"""You are Echoself AI, analyzing a user's {timeframe} mood patterns. 
+MOOD_SUMMARY_PROMPT = """You are Echoself AI, analyzing a user's {timeframe} mood patterns. 
 
 Mood Analysis Data:
-- Dominant mood: {mood_data.get('dominant_mood', 'neutral')}
-- Mood trend: {mood_data.get('mood_trend', 'stable')}
-- Mood distribution: {mood_data.get('mood_distribution', {})}
-- Sentiment distribution: {mood_data.get('sentiment_distribution', {})}
-- Total messages analyzed: {mood_data.get('total_messages', 0)}
+- Dominant mood: {dominant_mood}
+- Mood trend: {mood_trend}
+- Mood distribution: {mood_distribution}
+- Sentiment distribution: {sentiment_distribution}
+- Total messages analyzed: {total_messages}
 
 Provide a compassionate, insightful summary that:
 1. Highlights key mood patterns
@@ -69,17 +178,7 @@ Provide a compassionate, insightful summary that:
 
 Keep the response personal and caring, as if speaking to a close friend."""
 
-            response = self.model.generate_content(prompt)
-            return response.text
-            
-        except Exception as e:
-            logger.error(f"Error generating mood summary: {e}")
-            return "I'm having trouble analyzing your mood patterns right now. Please try again later."
-    
-    async def generate_reminder_message(self, reminder_content: str, context: str = "") -> str:
-        """Generate a personalized reminder message"""
-        try:
-            prompt = f"""You are Echoself AI, sending a gentle reminder to a user.
+REMINDER_PROMPT = """You are Echoself AI, sending a gentle reminder to a user.
 
 Reminder: {reminder_content}
 Context: {context}
@@ -92,17 +191,7 @@ Create a warm, personal reminder message that:
 
 Keep it concise and personal."""
 
-            response = self.model.generate_content(prompt)
-            return response.text
-            
-        except Exception as e:
-            logger.error(f"Error generating reminder message: {e}")
-            return f"Gentle reminder: {reminder_content}"
-    
-    async def analyze_message_intent(self, message: str) -> Dict:
-        """Analyze the intent of an incoming message"""
-        try:
-            prompt = f"""Analyze this message and determine the user's intent:
+INTENT_PROMPT = """Analyze this message and determine the user's intent:
 
 Message: "{message}"
 
@@ -119,19 +208,196 @@ Also determine:
 - needs_response: true/false
 
 Respond in JSON format:
-{
+{{
   "intent": "intent_category",
   "emotional_tone": "tone",
   "urgency": "level",
   "needs_response": boolean,
   "confidence": 0.0-1.0
-}"""
+}}"""
 
-            response = self.model.generate_content(prompt)
-            # Parse JSON response (simplified - in production, use proper JSON parsing)
-            import json
+@lru_cache(maxsize=1)
+def _get_model() -> genai.GenerativeModel:
+    """Configure Gemini once and share the model across clients"""
+    genai.configure(api_key=settings.GEMINI_API_KEY)
+    return genai.GenerativeModel(settings.GEMINI_MODEL)
+
+class LLMClient:
+    def __init__(self, embedding_model=None, embed_texts: Optional[Callable[[List[str]], np.ndarray]] = None):
+        self.model = _get_model()
+        self._intent_cache = TTLCache(maxsize=1024, ttl=3600)
+        
+        # Optional SentenceTransformer for local intent classification; embed_texts
+        # lets a MemoryStore share its embedding cache with the classifier
+        self.embedding_model = embedding_model
+        self._embed_texts = embed_texts
+        self.sentiment_analyzer = get_sentiment_analyzer()
+        self._intent_labels = None
+        self._intent_prototypes = None
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Unit-length embeddings through the shared encode path"""
+        if self._embed_texts is not None:
+            return self._embed_texts(texts)
+        return encode_embeddings(self.embedding_model, texts, normalize_embeddings=True)
+    
+    def _classify_intent_locally(self, message: str) -> Optional[Dict]:
+        """Classify intent by nearest labeled example; None if unsure"""
+        if self.embedding_model is None:
+            return None
+        
+        if self._intent_prototypes is None:
+            labels = [intent for intent, examples in INTENT_EXAMPLES.items() for _ in examples]
+            examples = [example for examples in INTENT_EXAMPLES.values() for example in examples]
+            self._intent_labels = labels
+            self._intent_prototypes = self._encode(examples)
+        
+        message_embedding = self._encode([message])[0]
+        similarities = self._intent_prototypes @ message_embedding
+        best = int(np.argmax(similarities))
+        confidence = float(similarities[best])
+        if confidence < INTENT_MIN_SIMILARITY:
+            return None
+        
+        sentiment = self.sentiment_analyzer.analyze_sentiment(message).sentiment
+        return {
+            "intent": self._intent_labels[best],
+            "emotional_tone": sentiment,
+            "urgency": "low",
+            "needs_response": True,
+            "confidence": confidence
+        }
+    
+    def _dedupe_memories(self, memories: List[Dict]) -> List[Dict]:
+        """Drop memories whose embedding nearly matches an earlier one"""
+        with_embedding = [
+            i for i, memory in enumerate(memories)
+            if memory.get('embedding') is not None and len(memory['embedding'])
+        ]
+        if len(with_embedding) < 2:
+            return list(memories)
+        
+        # Every pairwise similarity in one matrix product; embeddings are unit length
+        vectors = np.asarray([memories[i]['embedding'] for i in with_embedding], dtype=np.float32)
+        similarities = vectors @ vectors.T
+        
+        dropped = set()
+        kept_rows = []
+        for row, index in enumerate(with_embedding):
+            if kept_rows and similarities[row, kept_rows].max() > DUPLICATE_SIMILARITY:
+                dropped.add(index)
+            else:
+                kept_rows.append(row)
+        return [memory for i, memory in enumerate(memories) if i not in dropped]
+    
+    def _build_reflection_prompt(self, query: str, memories: List[Dict]) -> str:
+        """Build the reflection prompt from the query and retrieved memories"""
+        memories = self._dedupe_memories(memories)
+        
+        # Prepare context from memories
+        memory_context = "".join(
+            MEMORY_CONTEXT_ENTRY.format(
+                index=i,
+                timestamp=memory.get('timestamp', 'Unknown time'),
+                mood=memory.get('sentiment_analysis', {}).get('mood', 'neutral'),
+                content=memory.get('content', '')[:MEMORY_CONTENT_LIMIT]
+            )
+            for i, memory in enumerate(memories[:5], 1)  # Limit to top 5 memories
+        )
+        
+        return REFLECTION_PROMPT.format(query=query, memory_context=memory_context)
+    
+    def _build_mood_summary_prompt(self, mood_data: Dict, timeframe: str) -> str:
+        """Build the mood summary prompt from analyzed mood data"""
+        return MOOD_SUMMARY_PROMPT.format(
+            timeframe=timeframe,
+            dominant_mood=mood_data.get('dominant_mood', 'neutral'),
+            mood_trend=mood_data.get('mood_trend', 'stable'),
+            mood_distribution=mood_data.get('mood_distribution', {}),
+            sentiment_distribution=mood_data.get('sentiment_distribution', {}),
+            total_messages=mood_data.get('total_messages', 0)
+        )
+    
+    async def _stream(self, prompt: str) -> AsyncIterator[str]:
+        """Yield response text chunks as Gemini produces them"""
+        response = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+    
+    async def generate_reflection(self, query: str, memories: List[Dict]) -> str:
+        """Generate a reflective response based on query and retrieved memories
+        
+        Gemini errors propagate, so callers can tell a fallback from a reflection.
+        """
+        prompt = self._build_reflection_prompt(query, memories)
+        response = await self.model.generate_content_async(prompt)
+        return response.text
+    
+    async def stream_reflection(self, query: str, memories: List[Dict]) -> AsyncIterator[str]:
+        """Stream a reflective response chunk by chunk"""
+        try:
+            async for text in self._stream(self._build_reflection_prompt(query, memories)):
+                yield text
+        except Exception as e:
+            logger.error(f"Error streaming reflection: {e}")
+            yield REFLECTION_FALLBACK
+    
+    async def generate_mood_summary(self, mood_data: Dict, timeframe: str = "recent") -> str:
+        """Generate a mood summary report"""
+        try:
+            prompt = self._build_mood_summary_prompt(mood_data, timeframe)
+            response = await self.model.generate_content_async(prompt)
+            return response.text
+            
+        except Exception as e:
+            logger.error(f"Error generating mood summary: {e}")
+            return "I'm having trouble analyzing your mood patterns right now. Please try again later."
+    
+    async def stream_mood_summary(self, mood_data: Dict, timeframe: str = "recent") -> AsyncIterator[str]:
+        """Stream a mood summary report chunk by chunk"""
+        try:
+            async for text in self._stream(self._build_mood_summary_prompt(mood_data, timeframe)):
+                yield text
+        except Exception as e:
+            logger.error(f"Error streaming mood summary: {e}")
+            yield "I'm having trouble analyzing your mood patterns right now. Please try again later."
+    
+    async def generate_reminder_message(self, reminder_content: str, context: str = "") -> str:
+        """Generate a personalized reminder message"""
+        try:
+            prompt = REMINDER_PROMPT.format(reminder_content=reminder_content, context=context)
+            response = await self.model.generate_content_async(prompt)
+            return response.text
+            
+        except Exception as e:
+            logger.error(f"Error generating reminder message: {e}")
+            return f"Gentle reminder: {reminder_content}"
+    
+    async def analyze_message_intent(self, message: str) -> Dict:
+        """Analyze the intent of an incoming message"""
+        cache_key = hashlib.blake2b(message.strip().lower().encode(), digest_size=16).hexdigest()
+        cached = self._intent_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+        
+        try:
+            # The encoder forward pass runs off the event loop
+            intent = await asyncio.get_running_loop().run_in_executor(
+                None, self._classify_intent_locally, message
+            )
+            if intent is not None:
+                self._intent_cache[cache_key] = intent
+                return dict(intent)
+            
+            prompt = INTENT_PROMPT.format(message=message)
+            response = await self.model.generate_content_async(prompt)
+            # Parse the JSON object out of the response
             try:
-                return json.loads(response.text)
+                match = JSON_OBJECT_RE.search(response.text)
+                intent = orjson.loads(match.group(0))
+                self._intent_cache[cache_key] = intent
+                return dict(intent)
             except:
                 return {
                     "intent": "general_chat",
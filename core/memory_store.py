@@ -2,24 +2,77 @@
 Memory storage and retrieval using Qdrant vector database
 """
 import asyncio
+import base64
+import concurrent.futures
+import hashlib
 import json
+import os
+import threading
 import uuid
-from datetime import datetime
-from typing import List, Dict, Optional, Any
-from dataclasses import dataclass, asdict
-from sentence_transformers import SentenceTransformer
+from functools import lru_cache
+from datetime import datetime, timedelta
+from typing import Callable, List, Dict, Optional, Any, Tuple
+from dataclasses import dataclass
+import numpy as np
+from cachetools import LRUCache
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 from qdrant_client.http.models import Distance, VectorParams, PointStruct
 import logging
 
 from config import settings
-from core.encryption import MemoryEncryption
-from core.sentiment_analyzer import SentimentAnalyzer, SentimentResult
+from core.embedding_backend import encode_embeddings, load_embedding_model, resolve_embedding_dtype
+from core.encryption import load_encryption
+from core.sentiment_analyzer import MOOD_INDEX, SENTIMENT_INDEX, SentimentResult, get_sentiment_analyzer
 
 logger = logging.getLogger(__name__)
 
-@dataclass
+# The background writer upserts once this many points are queued or the
+# flush interval has passed, whichever comes first
+UPSERT_BATCH_SIZE = 64
+UPSERT_FLUSH_INTERVAL = 0.1  # seconds
+# Failed upserts are retried with exponential backoff before on_write_error
+WRITE_RETRIES = 3
+WRITE_RETRY_DELAY = 0.5  # seconds, doubled after each failed attempt
+
+# Queued by shutdown so the writer flushes what it holds and exits
+_WRITER_STOP = object()
+
+# Content with fewer words than this skips sentiment analysis
+MIN_SENTIMENT_WORDS = 3
+_NEUTRAL_SENTIMENT = {
+    'sentiment': 'neutral',
+    'mood': 'neutral',
+    'confidence': 0.5,
+    'emotions': [],
+    'intensity': 1.0
+}
+
+# Embeddings of recently seen texts, so repeats ("ok", forwards) skip the encoder
+EMBEDDING_CACHE_SIZE = 4096
+
+# Result sets at least this large are decrypted on the thread pool
+DECRYPT_PARALLEL_THRESHOLD = 16
+
+NEUTRAL_MOOD_CODE = MOOD_INDEX['neutral']
+NEUTRAL_SENTIMENT_CODE = SENTIMENT_INDEX['neutral']
+MS_PER_DAY = 86_400_000
+
+# Keep an int8 copy in RAM for ANN; full vectors are used for rescoring
+QUANTIZATION_CONFIG = models.ScalarQuantization(
+    scalar=models.ScalarQuantizationConfig(
+        type=models.ScalarType.INT8,
+        always_ram=True
+    )
+)
+
+# HNSW beam width and quantized-candidate rescoring for searches
+SEARCH_PARAMS = models.SearchParams(
+    hnsw_ef=64,
+    quantization=models.QuantizationSearchParams(rescore=True, oversampling=2.0)
+)
+
+@dataclass(slots=True)
 class Memory:
     id: str
     content: str
@@ -30,275 +83,592 @@ class Memory:
     embedding: Optional[List[float]] = None
     
     def to_dict(self) -> Dict:
-        data = asdict(self)
-        data['timestamp'] = self.timestamp.isoformat()
-        return data
+        # Built by hand: asdict() deep-copies the nested sentiment/metadata dicts
+        return {
+            'id': self.id,
+            'content': self.content,
+            'content_type': self.content_type,
+            'timestamp': self.timestamp.isoformat(),
+            'sentiment_analysis': self.sentiment_analysis,
+            'metadata': self.metadata,
+            'embedding': self.embedding
+        }
     
     @classmethod
     def from_dict(cls, data: Dict) -> 'Memory':
         data['timestamp'] = datetime.fromisoformat(data['timestamp'])
         return cls(**data)
 
+def _payload_timestamp(payload: Dict) -> datetime:
+    """Memory time from the integer ts_ms, parsing ISO only for legacy points"""
+    ts_ms = payload.get('ts_ms')
+    if ts_ms is not None:
+        return datetime.fromtimestamp(ts_ms / 1000)
+    return datetime.fromisoformat(payload['timestamp'])
+
+def _content_key(text: str) -> bytes:
+    """Digest identifying a text in the in-memory embedding cache"""
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+@lru_cache(maxsize=1)
+def _get_embedder():
+    """Load the embedding model once per process"""
+    return load_embedding_model(settings.EMBEDDING_MODEL)
+
 class MemoryStore:
+    _embedding_dim: Optional[int] = None
+    
     def __init__(self):
         self.client = QdrantClient(
             url=settings.QDRANT_URL,
-            api_key=settings.QDRANT_API_KEY
+            api_key=settings.QDRANT_API_KEY,
+            prefer_grpc=settings.QDRANT_PREFER_GRPC,
+            grpc_port=settings.QDRANT_GRPC_PORT
+        )
+        self.embedding_model = _get_embedder()
+        # Filled from executor threads, so guarded by a lock
+        self._embedding_cache = LRUCache(maxsize=EMBEDDING_CACHE_SIZE)
+        self._embedding_cache_lock = threading.Lock()
+        self.sentiment_analyzer = get_sentiment_analyzer()
+        self.encryption = load_encryption(
+            settings.ENCRYPTION_KEY,
+            os.path.join(settings.DATA_DIR, settings.ENCRYPTION_KEY_FILE)
         )
-        self.embedding_model = SentenceTransformer(settings.EMBEDDING_MODEL)
-        self.sentiment_analyzer = SentimentAnalyzer()
-        self.encryption = MemoryEncryption(settings.ENCRYPTION_KEY)
         self.collection_name = settings.QDRANT_COLLECTION_NAME
         
-        # Initialize collection
-        asyncio.create_task(self._initialize_collection())
+        # Write-behind upserts
+        self._write_queue: asyncio.Queue = asyncio.Queue()
+        self._writer_task: Optional[asyncio.Task] = None
+        self.on_write_error: Optional[Callable[[Exception, List[PointStruct]], Any]] = None
+        # Called on the event loop once points are actually in Qdrant
+        self.on_write_complete: Optional[Callable[[List[PointStruct]], Any]] = None
+        
+        # Fernet decryption runs in OpenSSL, so large result sets decrypt in parallel
+        self._decrypt_pool = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+        
+        # Collection setup runs lazily on first use
+        self._initialized = False
+        self._init_lock = asyncio.Lock()
     
-    async def _initialize_collection(self):
+    async def _ensure_initialized(self):
+        """Initialize the collection once, even under concurrent first requests"""
+        if self._initialized:
+            return
+        async with self._init_lock:
+            if not self._initialized:
+                self._initialized = await self._initialize_collection()
+    
+    async def _initialize_collection(self) -> bool:
         """Initialize Qdrant collection if it doesn't exist"""
         try:
             collections = self.client.get_collections()
             collection_names = [col.name for col in collections.collections]
             
             if self.collection_name not in collection_names:
-                # Get embedding dimension
-                sample_embedding = self.embedding_model.encode(["sample text"])
-                embedding_dim = len(sample_embedding[0])
-                
                 self.client.create_collection(
                     collection_name=self.collection_name,
                     vectors_config=VectorParams(
-                        size=embedding_dim,
-                        distance=Distance.COSINE
-                    )
+                        size=self.embedding_dim,
+                        distance=Distance.COSINE,
+                        # Only an explicit half-precision EMBEDDING_DTYPE stores float16 vectors
+                        datatype=models.Datatype.FLOAT32 if resolve_embedding_dtype() == "float32" else models.Datatype.FLOAT16
+                    ),
+                    quantization_config=QUANTIZATION_CONFIG,
+                    hnsw_config=models.HnswConfigDiff(m=16, ef_construct=128)
                 )
                 logger.info(f"Created Qdrant collection: {self.collection_name}")
             else:
                 logger.info(f"Qdrant collection already exists: {self.collection_name}")
+                self._ensure_quantization()
+                self._backfill_ts_ms()
+            
+            # Integer index lets recent-memory queries order and range-filter server-side
+            self.client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name='ts_ms',
+                field_schema=models.PayloadSchemaType.INTEGER
+            )
+            return True
                 
         except Exception as e:
             logger.error(f"Failed to initialize Qdrant collection: {e}")
+            return False
+    
+    def _ensure_quantization(self):
+        """Add int8 quantization to collections created before it was configured"""
+        collection_info = self.client.get_collection(self.collection_name)
+        if collection_info.config.quantization_config is None:
+            self.client.update_collection(
+                collection_name=self.collection_name,
+                quantization_config=QUANTIZATION_CONFIG
+            )
+            logger.info(f"Enabled int8 quantization on {self.collection_name}")
+    
+    def _backfill_ts_ms(self):
+        """Add ts_ms to memories stored before it existed"""
+        missing_ts = models.Filter(must=[
+            models.IsEmptyCondition(is_empty=models.PayloadField(key='ts_ms'))
+        ])
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=missing_ts,
+                limit=256,
+                offset=offset,
+                with_payload=['timestamp']
+            )
+            # Each point gets its own value, but a whole page goes in one request
+            if points:
+                self.client.batch_update_points(
+                    collection_name=self.collection_name,
+                    update_operations=[
+                        models.SetPayloadOperation(set_payload=models.SetPayload(
+                            payload={'ts_ms': int(datetime.fromisoformat(point.payload['timestamp']).timestamp() * 1000)},
+                            points=[point.id]
+                        ))
+                        for point in points
+                    ]
+                )
+            if offset is None:
+                break
+    
+    @property
+    def embedding_dim(self) -> int:
+        """Embedding size read from the model config, without a forward pass"""
+        if MemoryStore._embedding_dim is None:
+            MemoryStore._embedding_dim = self.embedding_model.get_sentence_embedding_dimension()
+        return MemoryStore._embedding_dim
     
-    def _create_embedding(self, text: str) -> List[float]:
+    def _create_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Create embeddings for many texts, encoding only those not seen recently"""
+        if not texts:
+            return np.empty((0, self.embedding_dim), dtype=np.float32)
+        
+        keys = [_content_key(text) for text in texts]
+        with self._embedding_cache_lock:
+            cached = [self._embedding_cache.get(key) for key in keys]
+        
+        # Each distinct uncached text is encoded once
+        missing = {}
+        for key, text, embedding in zip(keys, texts, cached):
+            if embedding is None and key not in missing:
+                missing[key] = text
+        
+        encoded = {}
+        if missing:
+            encoded = dict(zip(missing, self._encode_texts(list(missing.values()))))
+            with self._embedding_cache_lock:
+                self._embedding_cache.update(encoded)
+        
+        return np.stack([
+            embedding if embedding is not None else encoded[key]
+            for key, embedding in zip(keys, cached)
+        ])
+    
+    def _encode_texts(self, texts: List[str]) -> np.ndarray:
+        """Encode texts in a single encode call
+        
+        Both backends length-sort each call into similar-length mini-batches,
+        so texts are tokenized only once, inside encode.
+        """
+        return encode_embeddings(
+            self.embedding_model,
+            texts,
+            batch_size=64,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+    
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        """Unit-length embeddings for texts through the embedding cache (blocking)"""
+        return self._create_embeddings(texts)
+    
+    def _create_embedding(self, text: str) -> np.ndarray:
         """Create embedding for text"""
         try:
-            embedding = self.embedding_model.encode([text])
-            return embedding[0].tolist()
+            return self._create_embeddings([text])[0]
         except Exception as e:
             logger.error(f"Failed to create embedding: {e}")
-            return []
+            return np.empty(0, dtype=np.float32)
     
-    async def store_memory(self, content: str, content_type: str, metadata: Dict = None) -> str:
-        """Store a new memory"""
-        try:
-            # Generate unique ID
-            memory_id = str(uuid.uuid4())
-            
-            # Analyze sentiment
-            sentiment_result = self.sentiment_analyzer.analyze_sentiment(content)
-            sentiment_data = {
+    def _analyze_contents(self, contents: List[str]) -> List[Dict]:
+        """Sentiment payload fields for each content, analyzed as one batch"""
+        sentiments = [None] * len(contents)
+        # Too-short content such as a bare link carries no signal
+        to_analyze = [i for i, content in enumerate(contents) if len(content.split()) >= MIN_SENTIMENT_WORDS]
+        results = self.sentiment_analyzer.analyze_sentiment_batch([contents[i] for i in to_analyze])
+        for i, sentiment_result in zip(to_analyze, results):
+            sentiments[i] = {
                 'sentiment': sentiment_result.sentiment,
                 'mood': sentiment_result.mood,
                 'confidence': sentiment_result.confidence,
                 'emotions': sentiment_result.emotions,
                 'intensity': sentiment_result.intensity
             }
+        return [
+            sentiment if sentiment is not None else {**_NEUTRAL_SENTIMENT, 'emotions': []}
+            for sentiment in sentiments
+        ]
+    
+    def _build_point(self, content_type: str, sentiment_data: Dict, encrypted_content: str,
+                     encrypted_metadata: str, embedding: np.ndarray) -> PointStruct:
+        """Package an analyzed, encrypted memory as a Qdrant point"""
+        timestamp = datetime.now()
+        return PointStruct(
+            id=str(uuid.uuid4()),
+            # Only serialize to Python floats at the client boundary
+            vector=embedding.astype(np.float32, copy=False).tolist(),
+            payload={
+                'content_type': content_type,
+                'timestamp': timestamp.isoformat(),
+                'ts_ms': int(timestamp.timestamp() * 1000),
+                'sentiment': sentiment_data['sentiment'],
+                'mood': sentiment_data['mood'],
+                'emotions': sentiment_data['emotions'],
+                'intensity': sentiment_data['intensity'],
+                'confidence': sentiment_data['confidence'],
+                'encrypted_content': encrypted_content,
+                'encrypted_metadata': encrypted_metadata
+            }
+        )
+    
+    async def store_memories_batch(self, items: List[Dict]) -> List[str]:
+        """Store several memories with one encode and one upsert
+        
+        Each item needs 'content' and 'content_type' and may carry 'metadata'.
+        Small batches are written behind: the ids are returned before the
+        upsert lands.
+        """
+        memory_ids, _ = await self._store_batch(items)
+        return memory_ids
+    
+    async def _store_batch(self, items: List[Dict]) -> Tuple[List[str], List[Dict]]:
+        """Store memories, returning their ids and the sentiment computed for each"""
+        try:
+            await self._ensure_initialized()
+            contents = [item['content'] for item in items]
             
-            # Create embedding
-            embedding = self._create_embedding(content)
-            
-            # Create memory object
-            memory = Memory(
-                id=memory_id,
-                content=content,
-                content_type=content_type,
-                timestamp=datetime.now(),
-                sentiment_analysis=sentiment_data,
-                metadata=metadata or {},
-                embedding=embedding
+            # Embedding, sentiment and encryption are independent and release the
+            # GIL into torch/OpenSSL, so run them side by side on the executor
+            loop = asyncio.get_running_loop()
+            embed_future = loop.run_in_executor(None, self._create_embeddings, contents)
+            sentiment_future = loop.run_in_executor(None, self._analyze_contents, contents)
+            content_futures = asyncio.gather(*[
+                loop.run_in_executor(None, self.encryption.encrypt_data, content) for content in contents
+            ])
+            metadata_futures = asyncio.gather(*[
+                loop.run_in_executor(None, self.encryption.encrypt_json, item.get('metadata') or {})
+                for item in items
+            ])
+            embeddings, sentiments, encrypted_contents, encrypted_metadata = await asyncio.gather(
+                embed_future, sentiment_future, content_futures, metadata_futures
             )
             
-            # Encrypt sensitive content
-            encrypted_content = self.encryption.encrypt_data(content)
-            encrypted_metadata = self.encryption.encrypt_json(metadata or {})
-            
-            # Store in Qdrant
-            point = PointStruct(
-                id=memory_id,
-                vector=embedding,
-                payload={
-                    'content_type': content_type,
-                    'timestamp': memory.timestamp.isoformat(),
-                    'sentiment': sentiment_data['sentiment'],
-                    'mood': sentiment_data['mood'],
-                    'emotions': sentiment_data['emotions'],
-                    'intensity': sentiment_data['intensity'],
-                    'confidence': sentiment_data['confidence'],
-                    'encrypted_content': encrypted_content,
-                    'encrypted_metadata': encrypted_metadata
-                }
-            )
+            points = [
+                self._build_point(item['content_type'], sentiment_data, enc_content, enc_metadata, embedding)
+                for item, sentiment_data, enc_content, enc_metadata, embedding
+                in zip(items, sentiments, encrypted_contents, encrypted_metadata, embeddings)
+            ]
             
-            self.client.upsert(
-                collection_name=self.collection_name,
-                points=[point]
-            )
+            if len(points) >= UPSERT_BATCH_SIZE:
+                # Large batches skip the queue and upload in parallel chunks
+                await asyncio.to_thread(
+                    self.client.upload_points,
+                    collection_name=self.collection_name,
+                    points=points,
+                    batch_size=UPSERT_BATCH_SIZE,
+                    parallel=4
+                )
+                self._notify_write_complete(points)
+            else:
+                self._enqueue_points(points)
             
-            logger.info(f"Stored memory: {memory_id}")
-            return memory_id
+            memory_ids = [point.id for point in points]
+            logger.info(f"Stored memories: {', '.join(memory_ids)}")
+            return memory_ids, sentiments
             
         except Exception as e:
-            logger.error(f"Failed to store memory: {e}")
+            logger.error(f"Failed to store memories: {e}")
             raise
     
-    async def search_memories(self, query: str, limit: int = 10, filters: Dict = None) -> List[Memory]:
-        """Search for relevant memories"""
+    def _enqueue_points(self, points: List[PointStruct]):
+        """Hand points to the background writer without waiting for the upsert"""
+        if self._writer_task is None or self._writer_task.done():
+            self._writer_task = asyncio.create_task(self._writer_loop())
+        for point in points:
+            self._write_queue.put_nowait(point)
+    
+    async def _writer_loop(self):
+        """Drain the write queue, upserting up to a batch per flush interval"""
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._write_queue.get()
+            if item is _WRITER_STOP:
+                self._write_queue.task_done()
+                return
+            batch = [item]
+            taken = 1
+            deadline = loop.time() + UPSERT_FLUSH_INTERVAL
+            try:
+                while len(batch) < UPSERT_BATCH_SIZE:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._write_queue.get(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    taken += 1
+                    if item is _WRITER_STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                await self._flush_batch(batch)
+            finally:
+                for _ in range(taken):
+                    self._write_queue.task_done()
+    
+    async def _flush_batch(self, batch: List[PointStruct]):
+        """Upsert one batch off the event loop, retrying before reporting through on_write_error"""
+        delay = WRITE_RETRY_DELAY
+        for attempt in range(1, WRITE_RETRIES + 1):
+            try:
+                await asyncio.to_thread(
+                    self.client.upsert,
+                    collection_name=self.collection_name,
+                    points=batch
+                )
+                self._notify_write_complete(batch)
+                return
+            except Exception as e:
+                if attempt < WRITE_RETRIES:
+                    logger.warning(f"Failed to write {len(batch)} memories, retrying in {delay}s: {e}")
+                    await asyncio.sleep(delay)
+                    delay *= 2
+                    continue
+                logger.error(f"Failed to write {len(batch)} memories after {attempt} attempts: {e}")
+                if self.on_write_error is not None:
+                    try:
+                        self.on_write_error(e, batch)
+                    except Exception as callback_error:
+                        logger.error(f"Error in write error callback: {callback_error}")
+    
+    def _notify_write_complete(self, points: List[PointStruct]):
+        """Report points that reached Qdrant through on_write_complete"""
+        if self.on_write_complete is not None:
+            try:
+                self.on_write_complete(points)
+            except Exception as callback_error:
+                logger.error(f"Error in write complete callback: {callback_error}")
+    
+    async def shutdown(self):
+        """Flush pending writes and stop background workers"""
+        if self._writer_task is not None and not self._writer_task.done():
+            # The writer flushes everything queued ahead of the stop marker, retries included
+            self._write_queue.put_nowait(_WRITER_STOP)
+            await self._writer_task
+        
+        # Points queued after the writer stopped are written here before exit
+        pending = []
+        while not self._write_queue.empty():
+            item = self._write_queue.get_nowait()
+            self._write_queue.task_done()
+            if item is not _WRITER_STOP:
+                pending.append(item)
+        for start in range(0, len(pending), UPSERT_BATCH_SIZE):
+            await self._flush_batch(pending[start:start + UPSERT_BATCH_SIZE])
+        self._decrypt_pool.shutdown(wait=False)
+    
+    async def store_memory(self, content: str, content_type: str, metadata: Dict = None) -> Tuple[str, Dict]:
+        """Store a new memory, returning its id and sentiment analysis"""
+        memory_ids, sentiments = await self._store_batch([
+            {'content': content, 'content_type': content_type, 'metadata': metadata}
+        ])
+        return memory_ids[0], sentiments[0]
+    
+    def _build_filter(self, filters: Optional[Dict]) -> Optional[models.Filter]:
+        """Translate sentiment/mood/content_type filters into a Qdrant filter"""
+        filter_conditions = [
+            models.FieldCondition(key=key, match=models.MatchValue(value=value))
+            for key, value in (filters or {}).items()
+            if key in ('sentiment', 'mood', 'content_type')
+        ]
+        return models.Filter(must=filter_conditions) if filter_conditions else None
+    
+    def _to_memory(self, point) -> Memory:
+        """Decrypt a Qdrant point back into a Memory"""
+        payload = point.payload
+        
+        # Decrypt content and metadata
+        decrypted_content = self.encryption.decrypt_data(payload['encrypted_content'])
+        decrypted_metadata = self.encryption.decrypt_json(payload['encrypted_metadata'])
+        
+        return Memory(
+            id=point.id,
+            content=decrypted_content,
+            content_type=payload['content_type'],
+            timestamp=_payload_timestamp(payload),
+            sentiment_analysis={
+                'sentiment': payload['sentiment'],
+                'mood': payload['mood'],
+                'emotions': payload['emotions'],
+                'intensity': payload['intensity'],
+                'confidence': payload['confidence']
+            },
+            metadata=decrypted_metadata,
+            embedding=point.vector
+        )
+    
+    async def _to_memories(self, points) -> List[Memory]:
+        """Decrypt points, skipping any that fail"""
+        if len(points) < DECRYPT_PARALLEL_THRESHOLD:
+            results = []
+            for point in points:
+                try:
+                    results.append(self._to_memory(point))
+                except Exception as e:
+                    results.append(e)
+        else:
+            loop = asyncio.get_running_loop()
+            results = await asyncio.gather(
+                *[loop.run_in_executor(self._decrypt_pool, self._to_memory, point) for point in points],
+                return_exceptions=True
+            )
+        
+        memories = []
+        for point, result in zip(points, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to decrypt memory {point.id}: {result}")
+                continue
+            memories.append(result)
+        return memories
+    
+    async def search_memories_many(self, queries: List[str], limit: int = 10, filters: Dict = None) -> List[List[Memory]]:
+        """Search for several queries with one encode and one batched search"""
         try:
-            # Create query embedding
-            query_embedding = self._create_embedding(query)
+            await self._ensure_initialized()
             
-            # Build filter conditions
-            filter_conditions = []
-            if filters:
-                for key, value in filters.items():
-                    if key == 'sentiment':
-                        filter_conditions.append(
-                            models.FieldCondition(
-                                key='sentiment',
-                                match=models.MatchValue(value=value)
-                            )
-                        )
-                    elif key == 'mood':
-                        filter_conditions.append(
-                            models.FieldCondition(
-                                key='mood',
-                                match=models.MatchValue(value=value)
-                            )
-                        )
-                    elif key == 'content_type':
-                        filter_conditions.append(
-                            models.FieldCondition(
-                                key='content_type',
-                                match=models.MatchValue(value=value)
-                            )
-                        )
+            # Create query embeddings
+            query_embeddings = self._create_embeddings(queries)
+            query_filter = self._build_filter(filters)
             
             # Search
-            search_result = self.client.search(
+            responses = self.client.query_batch_points(
                 collection_name=self.collection_name,
-                query_vector=query_embedding,
-                query_filter=models.Filter(must=filter_conditions) if filter_conditions else None,
-                limit=limit,
-                with_payload=True
+                requests=[
+                    models.QueryRequest(
+                        query=embedding.astype(np.float32, copy=False).tolist(),
+                        filter=query_filter,
+                        limit=limit,
+                        params=SEARCH_PARAMS,
+                        with_payload=True,
+                        with_vector=True
+                    )
+                    for embedding in query_embeddings
+                ]
             )
             
             # Decrypt and convert results
-            memories = []
-            for result in search_result:
-                try:
-                    payload = result.payload
-                    
-                    # Decrypt content and metadata
-                    decrypted_content = self.encryption.decrypt_data(payload['encrypted_content'])
-                    decrypted_metadata = self.encryption.decrypt_json(payload['encrypted_metadata'])
-                    
-                    memory = Memory(
-                        id=result.id,
-                        content=decrypted_content,
-                        content_type=payload['content_type'],
-                        timestamp=datetime.fromisoformat(payload['timestamp']),
-                        sentiment_analysis={
-                            'sentiment': payload['sentiment'],
-                            'mood': payload['mood'],
-                            'emotions': payload['emotions'],
-                            'intensity': payload['intensity'],
-                            'confidence': payload['confidence']
-                        },
-                        metadata=decrypted_metadata
-                    )
-                    memories.append(memory)
-                    
-                except Exception as e:
-                    logger.error(f"Failed to decrypt memory {result.id}: {e}")
-                    continue
-            
-            return memories
+            return [await self._to_memories(response.points) for response in responses]
             
+        except (AttributeError, TypeError):
+            # Programming or client-API errors, not an unreachable Qdrant
+            raise
         except Exception as e:
             logger.error(f"Failed to search memories: {e}")
-            return []
+            return [[] for _ in queries]
+    
+    async def embed_query(self, query: str) -> np.ndarray:
+        """Embedding for a search query; searching the same text reuses it from the cache"""
+        loop = asyncio.get_running_loop()
+        embeddings = await loop.run_in_executor(None, self._create_embeddings, [query])
+        return embeddings[0]
+    
+    async def search_memories(self, query: str, limit: int = 10, filters: Dict = None) -> List[Memory]:
+        """Search for relevant memories"""
+        results = await self.search_memories_many([query], limit=limit, filters=filters)
+        return results[0]
     
-    async def get_recent_memories(self, limit: int = 20) -> List[Memory]:
-        """Get recent memories"""
+    async def get_recent_memories(self, limit: int = 20, since: Optional[datetime] = None) -> List[Memory]:
+        """Get recent memories, most recent first, optionally only those after since"""
         try:
-            # Get all points and sort by timestamp
+            await self._ensure_initialized()
+            
+            scroll_filter = None
+            if since is not None:
+                scroll_filter = models.Filter(must=[
+                    models.FieldCondition(
+                        key='ts_ms',
+                        range=models.Range(gte=int(since.timestamp() * 1000))
+                    )
+                ])
+            
+            # Qdrant orders by the indexed ts_ms, so no client-side sort is needed
             scroll_result = self.client.scroll(
                 collection_name=self.collection_name,
+                scroll_filter=scroll_filter,
+                order_by=models.OrderBy(key='ts_ms', direction=models.Direction.DESC),
                 limit=limit,
                 with_payload=True
             )
             
-            memories = []
-            for point in scroll_result[0]:
-                try:
-                    payload = point.payload
-                    
-                    # Decrypt content and metadata
-                    decrypted_content = self.encryption.decrypt_data(payload['encrypted_content'])
-                    decrypted_metadata = self.encryption.decrypt_json(payload['encrypted_metadata'])
-                    
-                    memory = Memory(
-                        id=point.id,
-                        content=decrypted_content,
-                        content_type=payload['content_type'],
-                        timestamp=datetime.fromisoformat(payload['timestamp']),
-                        sentiment_analysis={
-                            'sentiment': payload['sentiment'],
-                            'mood': payload['mood'],
-                            'emotions': payload['emotions'],
-                            'intensity': payload['intensity'],
-                            'confidence': payload['confidence']
-                        },
-                        metadata=decrypted_metadata
-                    )
-                    memories.append(memory)
-                    
-                except Exception as e:
-                    logger.error(f"Failed to decrypt memory {point.id}: {e}")
-                    continue
-            
-            # Sort by timestamp (most recent first)
-            memories.sort(key=lambda m: m.timestamp, reverse=True)
-            return memories[:limit]
+            return await self._to_memories(scroll_result[0])
             
         except Exception as e:
             logger.error(f"Failed to get recent memories: {e}")
             return []
     
+    async def _scroll_mood_arrays(self, cutoff: datetime):
+        """Local day numbers and mood/sentiment codes since cutoff, without fetching content"""
+        scroll_filter = models.Filter(must=[
+            models.FieldCondition(
+                key='ts_ms',
+                range=models.Range(gte=int(cutoff.timestamp() * 1000))
+            )
+        ])
+        payload_fields = models.PayloadSelectorInclude(include=['ts_ms', 'sentiment', 'mood'])
+        
+        payloads = []
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=scroll_filter,
+                limit=1000,
+                offset=offset,
+                with_payload=payload_fields
+            )
+            payloads.extend(point.payload for point in points)
+            if offset is None:
+                break
+        
+        count = len(payloads)
+        ts_ms = np.fromiter((payload['ts_ms'] for payload in payloads), dtype=np.int64, count=count)
+        moods = np.fromiter(
+            (MOOD_INDEX.get(payload['mood'], NEUTRAL_MOOD_CODE) for payload in payloads),
+            dtype=np.int8, count=count
+        )
+        sentiments = np.fromiter(
+            (SENTIMENT_INDEX.get(payload['sentiment'], NEUTRAL_SENTIMENT_CODE) for payload in payloads),
+            dtype=np.int8, count=count
+        )
+        
+        # Bucket by local calendar day, as the ISO timestamps were
+        offset_ms = int(datetime.now().astimezone().utcoffset().total_seconds() * 1000)
+        days = (ts_ms + offset_ms) // MS_PER_DAY
+        return days, moods, sentiments
+    
     async def get_mood_summary(self, days: int = 7) -> Dict:
         """Get mood summary for the last N days"""
         try:
-            # Get recent memories
-            memories = await self.get_recent_memories(limit=1000)
-            
-            # Filter by date range
-            cutoff_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            cutoff_date = cutoff_date.replace(day=cutoff_date.day - days)
+            await self._ensure_initialized()
             
-            recent_memories = [
-                m for m in memories 
-                if m.timestamp >= cutoff_date
-            ]
+            cutoff_date = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+            day_numbers, moods, sentiments = await self._scroll_mood_arrays(cutoff_date)
             
-            # Convert to dict format for analysis
-            memory_dicts = [
-                {
-                    'timestamp': m.timestamp.isoformat(),
-                    'sentiment_analysis': m.sentiment_analysis
-                }
-                for m in recent_memories
-            ]
-            
-            return self.sentiment_analyzer.analyze_mood_patterns(memory_dicts)
+            return self.sentiment_analyzer.analyze_mood_arrays(day_numbers, moods, sentiments)
             
         except Exception as e:
             logger.error(f"Failed to get mood summary: {e}")
@@ -311,10 +681,16 @@ class MemoryStore:
             
             export_data = {
                 'export_timestamp': datetime.now().isoformat(),
-                'total_memories': len(memories),
-                'memories': [memory.to_dict() for memory in memories]
+                'total_memories': len(memories)
             }
             
+            records = [memory.to_dict() for memory in memories]
+            if settings.BULK_MODE:
+                blob = self.encryption.encrypt_bulk(records)
+                export_data['encrypted_memories'] = base64.b64encode(blob).decode()
+            else:
+                export_data['memories'] = records
+            
             return export_data
             
         except Exception as e:
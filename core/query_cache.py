@@ -0,0 +1,81 @@
+"""
+Semantic cache for search responses, matched by query embedding similarity
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+# Cosine similarity at or above which two queries share a response
+SIMILARITY_THRESHOLD = 0.92
+MAX_ENTRIES_PER_USER = 128
+CACHE_TTL = 3600  # seconds
+
+class SemanticQueryCache:
+    """Per-user responses for recent queries, looked up by nearest embedding"""
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD,
+                 max_entries: int = MAX_ENTRIES_PER_USER, ttl: float = CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # user_id -> entry id -> (params, embedding, value, inserted_at), oldest use first
+        self._entries: Dict[str, OrderedDict] = {}
+        # user_id -> (entry ids, stacked unit embeddings), rebuilt after changes
+        self._matrices: Dict[str, Tuple[List[int], np.ndarray]] = {}
+        self._next_id = 0
+
+    def _matrix(self, user_id: str) -> Tuple[List[int], np.ndarray]:
+        """Entry ids and their embeddings stacked for one matrix-vector product"""
+        matrix = self._matrices.get(user_id)
+        if matrix is None:
+            entries = self._entries[user_id]
+            ids = list(entries)
+            matrix = (ids, np.stack([entry[1] for entry in entries.values()]))
+            self._matrices[user_id] = matrix
+        return matrix
+
+    def get(self, user_id: str, embedding: np.ndarray, params: Hashable = None) -> Optional[Any]:
+        """Cached value for the most similar fresh query with the same params"""
+        entries = self._entries.get(user_id)
+        if not entries:
+            return None
+
+        ids, matrix = self._matrix(user_id)
+        # Embeddings are unit length, so the dot product is the cosine similarity
+        similarities = matrix @ _unit(embedding)
+        cutoff = time.monotonic() - self.ttl
+        for index in np.argsort(similarities)[::-1]:
+            if similarities[index] < self.threshold:
+                break
+            entry_id = ids[index]
+            entry_params, _, value, inserted_at = entries[entry_id]
+            if entry_params == params and inserted_at >= cutoff:
+                entries.move_to_end(entry_id)
+                return value
+        return None
+
+    def put(self, user_id: str, embedding: np.ndarray, value: Any, params: Hashable = None):
+        """Cache a value for a query, evicting the user's least recently used entry"""
+        entries = self._entries.setdefault(user_id, OrderedDict())
+        entries[self._next_id] = (params, _unit(embedding), value, time.monotonic())
+        self._next_id += 1
+        if len(entries) > self.max_entries:
+            entries.popitem(last=False)
+        self._matrices.pop(user_id, None)
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """Drop one user's cached values, or everyone's"""
+        if user_id is None:
+            self._entries.clear()
+            self._matrices.clear()
+        else:
+            self._entries.pop(user_id, None)
+            self._matrices.pop(user_id, None)
+
+def _unit(embedding: np.ndarray) -> np.ndarray:
+    """Embedding as float32 scaled to unit length"""
+    embedding = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm > 0 else embedding
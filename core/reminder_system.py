@@ -2,19 +2,47 @@
 Reminder system for scheduling and managing user reminders
 """
 import asyncio
-import json
+import bisect
+import heapq
+import os
+import re
+import time
 import uuid
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
 import dateparser
 import logging
-from dataclasses import dataclass, asdict
+import orjson
+
+try:
+    import ijson  # Optional streaming parser for large snapshots
+except ImportError:
+    ijson = None
+from dataclasses import dataclass, field
 
 from config import settings
 
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Longest the checker sleeps without a wake-up, in seconds
+MAX_CHECK_INTERVAL = 3600
+
+DATEPARSER_SETTINGS = {
+    'PREFER_DATES_FROM': 'future',
+    'RETURN_AS_TIMEZONE_AWARE': False
+}
+
+# Fast paths for the phrases most reminders use; anything else goes to dateparser
+_RE_IN = re.compile(r'^in\s+(\d+|an?)\s+(second|minute|hour|day|week)s?$')
+_RE_AT = re.compile(r'^(?:(today|tomorrow)\s+)?(at\s+)?(\d{1,2})(?::(\d{2}))?\s*(am|pm)?$')
+_RE_NEXT_WEEKDAY = re.compile(r'^next\s+(monday|tuesday|wednesday|thursday|friday|saturday|sunday)(?:\s+(.+))?$')
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+# The journal is folded into the snapshot after this many entries
+JOURNAL_COMPACT_ENTRIES = 1000
+
+@dataclass(slots=True)
 class Reminder:
     id: str
     user_id: str
@@ -23,12 +51,23 @@ class Reminder:
     created_at: datetime
     is_sent: bool = False
     metadata: Dict = None
+    # Epoch seconds of scheduled_time, so due checks compare floats
+    scheduled_epoch: float = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        self.scheduled_epoch = self.scheduled_time.timestamp()
     
     def to_dict(self) -> Dict:
-        data = asdict(self)
-        data['scheduled_time'] = self.scheduled_time.isoformat()
-        data['created_at'] = self.created_at.isoformat()
-        return data
+        # Built by hand: asdict() deep-copies metadata for every reminder on save
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'content': self.content,
+            'scheduled_time': self.scheduled_time.isoformat(),
+            'created_at': self.created_at.isoformat(),
+            'is_sent': self.is_sent,
+            'metadata': self.metadata
+        }
     
     @classmethod
     def from_dict(cls, data: Dict) -> 'Reminder':
@@ -36,59 +75,253 @@ class Reminder:
         data['created_at'] = datetime.fromisoformat(data['created_at'])
         return cls(**data)
 
+def _parse_clock(match: re.Match, day: datetime) -> Optional[datetime]:
+    """Apply an _RE_AT clock time to day, or None if it isn't a clock time"""
+    _, at, hour, minute, meridiem = match.groups()
+    if not (at or minute or meridiem):
+        return None  # A bare number is too ambiguous
+    hour = int(hour)
+    minute = int(minute or 0)
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem == 'pm' else 0)
+    if hour > 23 or minute > 59:
+        return None
+    return day.replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+def _parse_common_time(text: str, now: datetime) -> Optional[datetime]:
+    """Parse the "in N units", "[tomorrow] at 9am" and "next friday" phrases directly"""
+    match = _RE_IN.match(text)
+    if match:
+        amount, unit = match.groups()
+        amount = 1 if amount in ('a', 'an') else int(amount)
+        return now + timedelta(**{f"{unit}s": amount})
+    
+    if text == 'tomorrow':
+        return now + timedelta(days=1)
+    
+    match = _RE_AT.match(text)
+    if match:
+        day = now + timedelta(days=1) if match.group(1) == 'tomorrow' else now
+        return _parse_clock(match, day)
+    
+    match = _RE_NEXT_WEEKDAY.match(text)
+    if match:
+        weekday, clock = match.groups()
+        days_ahead = (WEEKDAYS.index(weekday) - now.weekday() - 1) % 7 + 1
+        day = (now + timedelta(days=days_ahead)).replace(hour=0, minute=0, second=0, microsecond=0)
+        if clock is None:
+            return day
+        clock_match = _RE_AT.match(clock)
+        if clock_match and clock_match.group(1) is None:
+            return _parse_clock(clock_match, day)
+    
+    return None
+
+@lru_cache(maxsize=1024)
+def _parse_time_text(time_text: str, minute: int) -> Optional[datetime]:
+    """dateparser result for a phrase, cached per wall-clock minute
+    
+    Relative phrases such as "in 5 minutes" resolve against the first call
+    in that minute, so a cached answer is less than a minute stale.
+    """
+    return dateparser.parse(time_text, settings=DATEPARSER_SETTINGS)
+
+def _iter_snapshot_reminders(f) -> Iterator[Dict]:
+    """Reminder dicts from a snapshot file, streamed one at a time when ijson is available"""
+    if ijson is not None:
+        # use_float keeps metadata numbers orjson-serializable instead of Decimal
+        yield from ijson.items(f, 'reminders.item', use_float=True)
+    else:
+        yield from orjson.loads(f.read()).get('reminders', [])
+
+def _scheduled_epoch(reminder: Reminder) -> float:
+    return reminder.scheduled_epoch
+
 class ReminderSystem:
     def __init__(self):
         self.reminders: Dict[str, Reminder] = {}
-        self.reminder_callbacks = []
+        # Unsent reminders keyed by due time; cancelled or sent entries are skipped when popped
+        self._pending_heap: List[Tuple[float, str]] = []
+        # Each user's reminders, kept sorted by due time
+        self._by_user: Dict[str, List[Reminder]] = {}
+        # Split once at registration so firing needn't inspect each callback
+        self._async_callbacks = []
+        self._sync_callbacks = []
+        # Called once per checker pass with every reminder that came due in it
+        self._batch_callbacks = []
+        
+        # reminders.json is a periodic snapshot; mutations in between are appended to the journal
+        self._snapshot_path = os.path.join(settings.DATA_DIR, "reminders.json")
+        self._journal_path = os.path.join(settings.DATA_DIR, "reminders.journal")
+        self._journal = None
+        self._journal_entries = 0
+        # Serialized journal lines not yet written; the checker writes them in one go
+        self._pending_entries: List[bytes] = []
+        # Serializes journal appends and compaction, which run on worker threads
+        self._io_lock = asyncio.Lock()
         self._load_reminders()
         
-        # Start background task for checking reminders
-        asyncio.create_task(self._reminder_checker())
+        # Set on every mutation, so the checker writes the journal and re-plans its sleep
+        self._wake = asyncio.Event()
+        self._checker_task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        """Start the background reminder checker on the running event loop"""
+        if self._checker_task is None or self._checker_task.done():
+            self._checker_task = asyncio.get_running_loop().create_task(self._reminder_checker())
+    
+    async def stop(self):
+        """Stop the reminder checker and compact the journal into the snapshot"""
+        if self._checker_task is not None and not self._checker_task.done():
+            self._checker_task.cancel()
+            try:
+                await self._checker_task
+            except asyncio.CancelledError:
+                pass
+        await self._save_reminders()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
     
     def _load_reminders(self):
-        """Load reminders from storage"""
+        """Load the reminders snapshot, then replay the journal on top of it"""
         try:
-            import os
-            reminders_file = os.path.join(settings.DATA_DIR, "reminders.json")
-            if os.path.exists(reminders_file):
-                with open(reminders_file, 'r') as f:
-                    data = json.load(f)
-                    for reminder_data in data.get('reminders', []):
-                        reminder = Reminder.from_dict(reminder_data)
-                        self.reminders[reminder.id] = reminder
-                logger.info(f"Loaded {len(self.reminders)} reminders")
+            if os.path.exists(self._snapshot_path):
+                with open(self._snapshot_path, 'rb') as f:
+                    for reminder_data in _iter_snapshot_reminders(f):
+                        try:
+                            reminder = Reminder.from_dict(reminder_data)
+                            self.reminders[reminder.id] = reminder
+                        except Exception as e:
+                            logger.error(f"Skipping unreadable reminder: {e}")
+            
+            if os.path.exists(self._journal_path):
+                with open(self._journal_path, 'rb') as f:
+                    for line in f:
+                        try:
+                            self._apply_journal_entry(orjson.loads(line))
+                            self._journal_entries += 1
+                        except orjson.JSONDecodeError:
+                            # A crash mid-append leaves at most one torn last line
+                            logger.warning("Skipping unreadable reminder journal entry")
+            
+            self._pending_heap = [
+                (reminder.scheduled_epoch, reminder.id)
+                for reminder in self.reminders.values() if not reminder.is_sent
+            ]
+            heapq.heapify(self._pending_heap)
+            for reminder in sorted(self.reminders.values(), key=_scheduled_epoch):
+                self._by_user.setdefault(reminder.user_id, []).append(reminder)
+            logger.info(f"Loaded {len(self.reminders)} reminders")
         except Exception as e:
             logger.error(f"Error loading reminders: {e}")
     
-    def _save_reminders(self):
-        """Save reminders to storage"""
-        try:
-            import os
-            reminders_file = os.path.join(settings.DATA_DIR, "reminders.json")
-            data = {
-                'reminders': [reminder.to_dict() for reminder in self.reminders.values()],
-                'last_updated': datetime.now().isoformat()
-            }
-            with open(reminders_file, 'w') as f:
-                json.dump(data, f, indent=2)
-        except Exception as e:
-            logger.error(f"Error saving reminders: {e}")
+    def _apply_journal_entry(self, entry: Dict):
+        """Replay one create/cancel/sent journal entry"""
+        op = entry['op']
+        if op == 'create':
+            reminder = Reminder.from_dict(entry['reminder'])
+            self.reminders[reminder.id] = reminder
+        elif op == 'cancel':
+            self.reminders.pop(entry['id'], None)
+        elif op == 'sent' and entry['id'] in self.reminders:
+            self.reminders[entry['id']].is_sent = True
+    
+    def _index_reminder(self, reminder: Reminder):
+        """Insert a reminder into its user's time-sorted list"""
+        bisect.insort_right(self._by_user.setdefault(reminder.user_id, []), reminder, key=_scheduled_epoch)
+    
+    def _unindex_reminder(self, reminder: Reminder):
+        """Remove a reminder from its user's time-sorted list"""
+        user_reminders = self._by_user.get(reminder.user_id, [])
+        position = bisect.bisect_left(user_reminders, reminder.scheduled_epoch, key=_scheduled_epoch)
+        while position < len(user_reminders):
+            if user_reminders[position] is reminder:
+                del user_reminders[position]
+                break
+            position += 1
+        if not user_reminders:
+            self._by_user.pop(reminder.user_id, None)
+    
+    def _append_journal(self, entry: Dict):
+        """Queue one mutation as a JSON line and wake the checker to write it"""
+        self._pending_entries.append(orjson.dumps(entry, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE))
+        self._wake.set()
+    
+    def _append_lines(self, lines: bytes):
+        """Blocking append to the journal file"""
+        if self._journal is None:
+            self._journal = open(self._journal_path, 'ab')
+        self._journal.write(lines)
+        self._journal.flush()
+    
+    async def _write_journal(self):
+        """Write all queued journal lines with a single write off the event loop"""
+        if not self._pending_entries:
+            return
+        async with self._io_lock:
+            entries, self._pending_entries = self._pending_entries, []
+            try:
+                await asyncio.to_thread(self._append_lines, b''.join(entries))
+                self._journal_entries += len(entries)
+            except Exception as e:
+                logger.error(f"Error writing reminder journal: {e}")
+                # Keep them queued for the next pass
+                self._pending_entries[:0] = entries
+    
+    async def flush(self):
+        """Write queued reminder changes to the journal now"""
+        await self._write_journal()
+    
+    def _serialize_snapshot(self) -> bytes:
+        """Snapshot of every reminder as orjson bytes"""
+        data = {
+            'reminders': [reminder.to_dict() for reminder in self.reminders.values()],
+            'last_updated': datetime.now().isoformat()
+        }
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    
+    def _replace_snapshot(self, snapshot: bytes):
+        """Blocking atomic snapshot replace, then journal truncation"""
+        temp_path = f"{self._snapshot_path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._snapshot_path)
+        
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self._journal_path, 'wb')
+    
+    async def _save_reminders(self):
+        """Compact: write the full snapshot and truncate the journal"""
+        async with self._io_lock:
+            # Serialize on the loop so the snapshot is consistent; it holds every queued change
+            snapshot = self._serialize_snapshot()
+            entries, self._pending_entries = self._pending_entries, []
+            try:
+                await asyncio.to_thread(self._replace_snapshot, snapshot)
+                self._journal_entries = 0
+            except Exception as e:
+                logger.error(f"Error saving reminders: {e}")
+                self._pending_entries[:0] = entries
     
-    def parse_reminder_time(self, time_text: str) -> Optional[datetime]:
-        """Parse natural language time into datetime"""
+    def parse_reminder_time(self, time_text: str, now: Optional[datetime] = None) -> Optional[datetime]:
+        """Parse natural language time into datetime, relative to now"""
         try:
-            # Use dateparser to handle natural language
-            parsed_time = dateparser.parse(
-                time_text,
-                settings={
-                    'PREFER_DATES_FROM': 'future',
-                    'RETURN_AS_TIMEZONE_AWARE': False
-                }
-            )
+            now = now or datetime.now()
+            text = time_text.strip().lower()
+            parsed_time = _parse_common_time(text, now)
+            if parsed_time is None:
+                # Use dateparser to handle natural language; users repeat the same phrases
+                parsed_time = _parse_time_text(text, int(time.time() // 60))
             
             if parsed_time:
                 # If the parsed time is in the past, assume it's for tomorrow
-                if parsed_time < datetime.now():
+                if parsed_time < now:
                     parsed_time += timedelta(days=1)
                 
                 return parsed_time
@@ -99,28 +332,32 @@ class ReminderSystem:
             logger.error(f"Error parsing time '{time_text}': {e}")
             return None
     
-    async def create_reminder(self, user_id: str, content: str, time_text: str, metadata: Dict = None) -> Optional[str]:
+    async def create_reminder(self, user_id: str, content: str, time_text: str, metadata: Dict = None) -> Optional[Reminder]:
         """Create a new reminder"""
         try:
-            scheduled_time = self.parse_reminder_time(time_text)
+            # One clock read for parsing and the creation time
+            now = datetime.now()
+            scheduled_time = self.parse_reminder_time(time_text, now)
             if not scheduled_time:
                 return None
             
-            reminder_id = str(uuid.uuid4())
+            reminder_id = uuid.uuid4().hex
             reminder = Reminder(
                 id=reminder_id,
                 user_id=user_id,
                 content=content,
                 scheduled_time=scheduled_time,
-                created_at=datetime.now(),
+                created_at=now,
                 metadata=metadata or {}
             )
             
             self.reminders[reminder_id] = reminder
-            self._save_reminders()
+            self._index_reminder(reminder)
+            heapq.heappush(self._pending_heap, (reminder.scheduled_epoch, reminder_id))
+            self._append_journal({'op': 'create', 'reminder': reminder.to_dict()})
             
             logger.info(f"Created reminder {reminder_id} for {scheduled_time}")
-            return reminder_id
+            return reminder
             
         except Exception as e:
             logger.error(f"Error creating reminder: {e}")
@@ -129,14 +366,11 @@ class ReminderSystem:
     async def get_user_reminders(self, user_id: str, include_sent: bool = False) -> List[Reminder]:
         """Get all reminders for a user"""
         try:
-            user_reminders = [
-                reminder for reminder in self.reminders.values()
-                if reminder.user_id == user_id and (include_sent or not reminder.is_sent)
-            ]
-            
-            # Sort by scheduled time
-            user_reminders.sort(key=lambda r: r.scheduled_time)
-            return user_reminders
+            # Already sorted by scheduled time
+            user_reminders = self._by_user.get(user_id, [])
+            if include_sent:
+                return list(user_reminders)
+            return [reminder for reminder in user_reminders if not reminder.is_sent]
             
         except Exception as e:
             logger.error(f"Error getting user reminders: {e}")
@@ -149,7 +383,8 @@ class ReminderSystem:
                 reminder = self.reminders[reminder_id]
                 if reminder.user_id == user_id:
                     del self.reminders[reminder_id]
-                    self._save_reminders()
+                    self._unindex_reminder(reminder)
+                    self._append_journal({'op': 'cancel', 'id': reminder_id})
                     logger.info(f"Cancelled reminder {reminder_id}")
                     return True
             return False
@@ -160,42 +395,87 @@ class ReminderSystem:
     
     def add_reminder_callback(self, callback):
         """Add a callback function to be called when reminders are due"""
-        self.reminder_callbacks.append(callback)
+        if asyncio.iscoroutinefunction(callback):
+            self._async_callbacks.append(callback)
+        else:
+            self._sync_callbacks.append(callback)
+    
+    def add_reminder_batch_callback(self, callback):
+        """Add an async callback called with the list of reminders due in one pass"""
+        self._batch_callbacks.append(callback)
+    
+    def _next_due_time(self) -> Optional[float]:
+        """Epoch due time of the earliest pending reminder, dropping stale heap entries"""
+        while self._pending_heap:
+            scheduled_epoch, reminder_id = self._pending_heap[0]
+            reminder = self.reminders.get(reminder_id)
+            if reminder is not None and not reminder.is_sent:
+                return scheduled_epoch
+            heapq.heappop(self._pending_heap)
+        return None
+    
+    async def _dispatch(self, due: List[Reminder]):
+        """Fire callbacks for the reminders due in this pass, the async ones concurrently"""
+        for reminder in due:
+            for callback in self._sync_callbacks:
+                try:
+                    callback(reminder)
+                except Exception as e:
+                    logger.error(f"Error in reminder callback: {e}")
+        
+        results = await asyncio.gather(
+            *(callback(reminder) for reminder in due for callback in self._async_callbacks),
+            *(callback(due) for callback in self._batch_callbacks),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Error in reminder callback: {result}")
+        
+        for reminder in due:
+            logger.info(f"Processed reminder {reminder.id}")
     
     async def _reminder_checker(self):
         """Background task to check for due reminders"""
         while True:
             try:
-                now = datetime.now()
-                due_reminders = []
+                # Cleared before any await, so a change made while this pass
+                # dispatches or writes the journal still wakes the next wait
+                self._wake.clear()
+                now = time.time()
                 
-                for reminder in self.reminders.values():
-                    if not reminder.is_sent and reminder.scheduled_time <= now:
-                        due_reminders.append(reminder)
+                # Only the heap head can be due, so pop until it is in the future
+                due = []
+                while self._pending_heap and self._pending_heap[0][0] <= now:
+                    _, reminder_id = heapq.heappop(self._pending_heap)
+                    reminder = self.reminders.get(reminder_id)
+                    if reminder is None or reminder.is_sent:
+                        continue
+                    
+                    # Mark as sent
+                    reminder.is_sent = True
+                    self._append_journal({'op': 'sent', 'id': reminder.id})
+                    due.append(reminder)
                 
-                # Process due reminders
-                for reminder in due_reminders:
-                    try:
-                        # Mark as sent
-                        reminder.is_sent = True
-                        
-                        # Call all registered callbacks
-                        for callback in self.reminder_callbacks:
-                            try:
-                                await callback(reminder)
-                            except Exception as e:
-                                logger.error(f"Error in reminder callback: {e}")
-                        
-                        logger.info(f"Processed reminder {reminder.id}")
-                        
-                    except Exception as e:
-                        logger.error(f"Error processing reminder {reminder.id}: {e}")
+                if due:
+                    await self._dispatch(due)
                 
-                if due_reminders:
-                    self._save_reminders()
+                # Changes since the last pass go to disk together
+                await self._write_journal()
+                if self._journal_entries >= JOURNAL_COMPACT_ENTRIES:
+                    await self._save_reminders()
                 
-                # Check every 30 seconds
-                await asyncio.sleep(30)
+                # Sleep until the next reminder is due, or until reminders change.
+                # Due times are absolute, so they stay wall-clock epochs; the
+                # timeout itself runs on the loop's monotonic clock
+                next_due = self._next_due_time()
+                delay = MAX_CHECK_INTERVAL
+                if next_due is not None:
+                    delay = min(delay, max(0.0, next_due - time.time()))
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
                 
             except Exception as e:
                 logger.error(f"Error in reminder checker: {e}")
@@ -1,12 +1,71 @@
 """
 Sentiment and mood analysis for messages
 """
-import re
-from typing import Dict, List, Tuple
-from datetime import datetime
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+from datetime import date, datetime, timedelta
 from dataclasses import dataclass
+from functools import lru_cache
+import numpy as np
 
-@dataclass
+try:
+    import ahocorasick  # Optional single-pass keyword matcher (pyahocorasick)
+except ImportError:
+    ahocorasick = None
+
+try:
+    from numba import njit  # Optional JIT for the mood aggregation kernel
+except ImportError:
+    njit = None
+
+# Integer codes for the array-based mood summary; moods fall back to the
+# sentiment label when no emotion keyword matched
+MOOD_CODES = (
+    'happy', 'sad', 'anxious', 'angry', 'grateful', 'reflective', 'confused',
+    'tired', 'motivated', 'peaceful', 'positive', 'negative', 'neutral'
+)
+SENTIMENT_CODES = ('positive', 'negative', 'neutral')
+MOOD_INDEX = {mood: code for code, mood in enumerate(MOOD_CODES)}
+SENTIMENT_INDEX = {sentiment: code for code, sentiment in enumerate(SENTIMENT_CODES)}
+POSITIVE_MOODS = frozenset({'happy', 'grateful', 'motivated', 'peaceful'})
+# Bit i is set when MOOD_CODES[i] is positive; as a 0/1 vector it turns the
+# per-day positive count into one matrix-vector product
+POSITIVE_MOOD_MASK = sum(1 << MOOD_INDEX[mood] for mood in POSITIVE_MOODS)
+POSITIVE_MOOD_WEIGHTS = (POSITIVE_MOOD_MASK >> np.arange(len(MOOD_CODES))) & 1
+
+EPOCH_DATE = date(1970, 1, 1)
+
+@lru_cache(maxsize=8192)
+def _timestamp_date(timestamp: str) -> Optional[str]:
+    """ISO date of an ISO timestamp, parsed once per distinct string"""
+    try:
+        if timestamp.endswith('Z'):
+            timestamp = timestamp[:-1] + '+00:00'
+        return datetime.fromisoformat(timestamp).date().isoformat()
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def _mood_histogram_loop(days, moods, sentiments, n_moods, n_sentiments):
+    """Per-day mood counts and overall sentiment counts in one pass"""
+    first_day = days.min()
+    daily = np.zeros((days.max() - first_day + 1, n_moods), dtype=np.int64)
+    sentiment_counts = np.zeros(n_sentiments, dtype=np.int64)
+    for i in range(days.shape[0]):
+        daily[days[i] - first_day, moods[i]] += 1
+        sentiment_counts[sentiments[i]] += 1
+    return daily, sentiment_counts
+
+def _mood_histogram_numpy(days, moods, sentiments, n_moods, n_sentiments):
+    """Same counts as _mood_histogram_loop using NumPy scatter-adds"""
+    first_day = days.min()
+    daily = np.zeros((days.max() - first_day + 1, n_moods), dtype=np.int64)
+    np.add.at(daily, (days - first_day, moods), 1)
+    return daily, np.bincount(sentiments, minlength=n_sentiments).astype(np.int64)
+
+# Numba compiles the single-pass loop; without it np.add.at does the same work
+_mood_histogram = njit(cache=True)(_mood_histogram_loop) if njit is not None else _mood_histogram_numpy
+
+@dataclass(slots=True)
 class SentimentResult:
     sentiment: str  # positive, negative, neutral
     mood: str  # happy, sad, anxious, excited, reflective, etc.
@@ -14,6 +73,19 @@ class SentimentResult:
     emotions: List[str]
     intensity: float  # 0.0 to 1.0
 
+class _PunctuationTable(dict):
+    """str.translate table replacing non-word, non-space characters with spaces
+    
+    Replaces exactly what the regex [^\\w\\s] matches, emoji and
+    non-ASCII punctuation included; each code point is classified once.
+    """
+    
+    def __missing__(self, codepoint: int):
+        char = chr(codepoint)
+        replacement = codepoint if char.isalnum() or char == '_' or char.isspace() else ' '
+        self[codepoint] = replacement
+        return replacement
+
 class SentimentAnalyzer:
     def __init__(self):
         # Emotion keywords mapping
@@ -31,53 +103,108 @@ class SentimentAnalyzer:
         }
         
         # Sentiment indicators
-        self.positive_words = ['good', 'great', 'excellent', 'amazing', 'wonderful', 'fantastic', 'love', 'like', 'enjoy', 'happy', 'excited']
-        self.negative_words = ['bad', 'terrible', 'awful', 'hate', 'dislike', 'sad', 'angry', 'frustrated', 'disappointed', 'upset']
+        self.positive_words = frozenset(['good', 'great', 'excellent', 'amazing', 'wonderful', 'fantastic', 'love', 'like', 'enjoy', 'happy', 'excited'])
+        self.negative_words = frozenset(['bad', 'terrible', 'awful', 'hate', 'dislike', 'sad', 'angry', 'frustrated', 'disappointed', 'upset'])
+        self._word_polarity = {
+            **{word: 1 for word in self.positive_words},
+            **{word: -1 for word in self.negative_words}
+        }
         
         # Intensity modifiers
         self.intensity_modifiers = {
             'very': 1.5, 'extremely': 2.0, 'really': 1.3, 'so': 1.4, 'quite': 1.2,
             'somewhat': 0.8, 'a bit': 0.7, 'slightly': 0.6, 'kind of': 0.7
         }
+        
+        # Emotion keywords and intensity modifiers are all substring checks,
+        # so one automaton finds every one of them in a single scan
+        self._keyword_tags: Dict[str, List[Tuple[str, object]]] = {}
+        for emotion, keywords in self.emotion_keywords.items():
+            for keyword in keywords:
+                self._keyword_tags.setdefault(keyword, []).append(('emotion', emotion))
+        for modifier, multiplier in self.intensity_modifiers.items():
+            self._keyword_tags.setdefault(modifier, []).append(('modifier', multiplier))
+        
+        self._punct_table = _PunctuationTable()
+        
+        self._automaton = None
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for keyword in self._keyword_tags:
+                self._automaton.add_word(keyword, keyword)
+            self._automaton.make_automaton()
+    
+    def _matched_keywords(self, text_lower: str) -> set:
+        """Emotion keywords and modifiers occurring anywhere in the text"""
+        if self._automaton is not None:
+            return {keyword for _, keyword in self._automaton.iter(text_lower)}
+        return {keyword for keyword in self._keyword_tags if keyword in text_lower}
     
     def analyze_sentiment(self, text: str) -> SentimentResult:
         """Analyze sentiment and mood of text"""
         text_lower = text.lower()
         
         # Clean text for analysis
-        cleaned_text = re.sub(r'[^\w\s]', ' ', text_lower)
+        cleaned_text = text_lower.translate(self._punct_table)
         words = cleaned_text.split()
         
-        # Detect emotions
-        detected_emotions = []
-        emotion_scores = {}
-        
-        for emotion, keywords in self.emotion_keywords.items():
-            score = 0
-            for keyword in keywords:
-                if keyword in text_lower:
-                    score += 1
-            if score > 0:
-                emotion_scores[emotion] = score
-                detected_emotions.append(emotion)
-        
         # Calculate sentiment
         positive_score = sum(1 for word in words if word in self.positive_words)
         negative_score = sum(1 for word in words if word in self.negative_words)
         
-        # Apply intensity modifiers
+        return self._build_result(text_lower, len(words), positive_score, negative_score)
+    
+    def analyze_sentiment_batch(self, texts: List[str]) -> List[SentimentResult]:
+        """Analyze many texts, scoring all their words in one NumPy pass"""
+        if not texts:
+            return []
+        
+        lowered = [text.lower() for text in texts]
+        word_lists = [text_lower.translate(self._punct_table).split() for text_lower in lowered]
+        lengths = np.fromiter(map(len, word_lists), dtype=np.int64, count=len(texts))
+        
+        # One polarity code per word across the whole batch, then count per text
+        polarity = np.fromiter(
+            (self._word_polarity.get(word, 0) for words in word_lists for word in words),
+            dtype=np.int8,
+            count=int(lengths.sum())
+        )
+        text_index = np.repeat(np.arange(len(texts)), lengths)
+        positive_scores = np.bincount(text_index[polarity > 0], minlength=len(texts))
+        negative_scores = np.bincount(text_index[polarity < 0], minlength=len(texts))
+        
+        return [
+            self._build_result(text_lower, int(word_count), int(positive), int(negative))
+            for text_lower, word_count, positive, negative
+            in zip(lowered, lengths, positive_scores, negative_scores)
+        ]
+    
+    def _build_result(self, text_lower: str, word_count: int, positive_score: int, negative_score: int) -> SentimentResult:
+        """Combine keyword matches and word polarity counts into a SentimentResult"""
+        # Detect emotions (each matched keyword counts once) and intensity modifiers
+        matched_scores = {}
         intensity = 1.0
-        for modifier, multiplier in self.intensity_modifiers.items():
-            if modifier in text_lower:
-                intensity *= multiplier
+        for keyword in self._matched_keywords(text_lower):
+            for kind, value in self._keyword_tags[keyword]:
+                if kind == 'emotion':
+                    matched_scores[value] = matched_scores.get(value, 0) + 1
+                else:
+                    intensity *= value
+        
+        # Keep emotion order stable so ties pick the same primary mood
+        emotion_scores = {
+            emotion: matched_scores[emotion]
+            for emotion in self.emotion_keywords if emotion in matched_scores
+        }
+        detected_emotions = list(emotion_scores)
         
         # Determine overall sentiment
         if positive_score > negative_score:
             sentiment = 'positive'
-            confidence = min(0.9, (positive_score - negative_score) / len(words) * 10)
+            confidence = min(0.9, (positive_score - negative_score) / word_count * 10)
         elif negative_score > positive_score:
             sentiment = 'negative'
-            confidence = min(0.9, (negative_score - positive_score) / len(words) * 10)
+            confidence = min(0.9, (negative_score - positive_score) / word_count * 10)
         else:
             sentiment = 'neutral'
             confidence = 0.5
@@ -104,43 +231,88 @@ class SentimentAnalyzer:
         if not messages:
             return {}
         
-        mood_counts = {}
-        sentiment_counts = {'positive': 0, 'negative': 0, 'neutral': 0}
-        daily_moods = {}
+        mood_counts = Counter()
+        sentiment_counts = Counter()
+        daily_moods = defaultdict(Counter)
         
         for msg in messages:
-            if 'sentiment_analysis' in msg:
-                analysis = msg['sentiment_analysis']
-                mood = analysis.get('mood', 'neutral')
-                sentiment = analysis.get('sentiment', 'neutral')
-                timestamp = msg.get('timestamp', '')
-                
-                # Count moods
-                mood_counts[mood] = mood_counts.get(mood, 0) + 1
-                sentiment_counts[sentiment] += 1
-                
-                # Group by day
-                if timestamp:
-                    try:
-                        date = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).date()
-                        date_str = date.isoformat()
-                        if date_str not in daily_moods:
-                            daily_moods[date_str] = []
-                        daily_moods[date_str].append(mood)
-                    except:
-                        pass
+            analysis = msg.get('sentiment_analysis')
+            if analysis is None:
+                continue
+            mood = analysis.get('mood', 'neutral')
+            mood_counts[mood] += 1
+            sentiment_counts[analysis.get('sentiment', 'neutral')] += 1
+            
+            # Group by day
+            timestamp = msg.get('timestamp', '')
+            if timestamp:
+                date_str = _timestamp_date(timestamp)
+                if date_str is not None:
+                    daily_moods[date_str][mood] += 1
         
         # Calculate dominant mood
-        dominant_mood = max(mood_counts.keys(), key=lambda k: mood_counts[k]) if mood_counts else 'neutral'
+        dominant_mood = max(mood_counts, key=mood_counts.__getitem__) if mood_counts else 'neutral'
         
         # Calculate mood trend (last 7 days vs previous 7 days)
-        recent_dates = sorted(daily_moods.keys())[-7:]
-        previous_dates = sorted(daily_moods.keys())[-14:-7] if len(daily_moods) >= 14 else []
+        dates = sorted(daily_moods)
+        recent_dates = dates[-7:]
+        previous_dates = dates[-14:-7] if len(dates) >= 14 else []
         
         trend = "stable"
         if recent_dates and previous_dates:
-            recent_positive = sum(1 for date in recent_dates for mood in daily_moods[date] if mood in ['happy', 'grateful', 'motivated', 'peaceful'])
-            previous_positive = sum(1 for date in previous_dates for mood in daily_moods[date] if mood in ['happy', 'grateful', 'motivated', 'peaceful'])
+            recent_positive = sum(daily_moods[date][mood] for date in recent_dates for mood in POSITIVE_MOODS)
+            previous_positive = sum(daily_moods[date][mood] for date in previous_dates for mood in POSITIVE_MOODS)
+            
+            if recent_positive > previous_positive * 1.2:
+                trend = "improving"
+            elif recent_positive < previous_positive * 0.8:
+                trend = "declining"
+        
+        return {
+            'mood_distribution': dict(mood_counts),
+            'sentiment_distribution': {sentiment: sentiment_counts[sentiment] for sentiment in SENTIMENT_CODES},
+            'dominant_mood': dominant_mood,
+            'mood_trend': trend,
+            'daily_patterns': {date: dict(moods) for date, moods in daily_moods.items()},
+            'total_messages': len(messages)
+        }
+
+    def analyze_mood_arrays(self, days: np.ndarray, moods: np.ndarray, sentiments: np.ndarray) -> Dict:
+        """Mood patterns from day numbers and MOOD_CODES/SENTIMENT_CODES arrays
+        
+        Same result shape as analyze_mood_patterns, for callers that already
+        hold the fields column-wise (days count from 1970-01-01).
+        """
+        if len(days) == 0:
+            return {}
+        
+        daily, sentiment_counts = _mood_histogram(
+            days.astype(np.int64, copy=False),
+            moods.astype(np.int64, copy=False),
+            sentiments.astype(np.int64, copy=False),
+            len(MOOD_CODES),
+            len(SENTIMENT_CODES)
+        )
+        first_day = int(days.min())
+        
+        totals = daily.sum(axis=0)
+        mood_counts = {MOOD_CODES[code]: int(count) for code, count in enumerate(totals) if count}
+        dominant_mood = MOOD_CODES[int(totals.argmax())]
+        
+        active_days = np.flatnonzero(daily.sum(axis=1))
+        daily_moods = {
+            (EPOCH_DATE + timedelta(days=first_day + int(day))).isoformat(): {
+                MOOD_CODES[code]: int(daily[day, code]) for code in np.flatnonzero(daily[day])
+            }
+            for day in active_days
+        }
+        
+        # Calculate mood trend (last 7 active days vs previous 7)
+        trend = "stable"
+        if len(active_days) >= 14:
+            positive_per_day = daily[active_days] @ POSITIVE_MOOD_WEIGHTS
+            recent_positive = positive_per_day[-7:].sum()
+            previous_positive = positive_per_day[-14:-7].sum()
             
             if recent_positive > previous_positive * 1.2:
                 trend = "improving"
@@ -149,9 +321,16 @@ class SentimentAnalyzer:
         
         return {
             'mood_distribution': mood_counts,
-            'sentiment_distribution': sentiment_counts,
+            'sentiment_distribution': {
+                sentiment: int(count) for sentiment, count in zip(SENTIMENT_CODES, sentiment_counts)
+            },
             'dominant_mood': dominant_mood,
             'mood_trend': trend,
             'daily_patterns': daily_moods,
-            'total_messages': len(messages)
-        }
\ No newline at end of file
+            'total_messages': len(days)
+        }
+
+@lru_cache(maxsize=1)
+def get_sentiment_analyzer() -> SentimentAnalyzer:
+    """Shared analyzer instance; it holds no per-call state"""
+    return SentimentAnalyzer()
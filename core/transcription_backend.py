@@ -0,0 +1,130 @@
+"""
+Speech-to-text backends for voice message transcription
+"""
+import io
+import os
+import logging
+import tempfile
+from typing import Dict, Union
+
+import numpy as np
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+
+# Quantized GGML weights for the sizes that have a q5_1 build
+GGML_QUANTIZED_MODELS = {
+    'tiny': 'tiny-q5_1',
+    'tiny.en': 'tiny.en-q5_1',
+    'base': 'base-q5_1',
+    'base.en': 'base.en-q5_1',
+    'small': 'small-q5_1',
+    'small.en': 'small.en-q5_1'
+}
+
+class WhisperCppTranscriber:
+    """whisper.cpp model with the openai-whisper transcribe() result shape"""
+
+    def __init__(self, model_name: str, n_threads: int = None):
+        # Optional dependency: pip install pywhispercpp
+        from pywhispercpp.model import Model
+
+        self.model = Model(
+            GGML_QUANTIZED_MODELS.get(model_name, model_name),
+            n_threads=n_threads or os.cpu_count(),
+            print_progress=False,
+            print_realtime=False
+        )
+
+    def transcribe(self, audio: Union[str, np.ndarray], language: str = None) -> Dict:
+        segments = self.model.transcribe(audio, language=language or 'auto', no_context=True)
+        return {'text': ''.join(segment.text for segment in segments)}
+
+def load_whisper_model(model_name: str = None, n_threads: int = None):
+    """Load the configured speech-to-text backend, falling back to openai-whisper"""
+    model_name = model_name or settings.WHISPER_MODEL
+
+    if settings.WHISPER_BACKEND == "whispercpp":
+        try:
+            return WhisperCppTranscriber(model_name, n_threads=n_threads)
+        except Exception as e:
+            logger.warning(f"whisper.cpp backend unavailable, using openai-whisper: {e}")
+
+    import torch
+    import whisper
+    if n_threads:
+        torch.set_num_threads(n_threads)
+    return whisper.load_model(model_name)
+
+def decode_audio(audio_data: bytes) -> np.ndarray:
+    """Decode audio bytes in memory to 16 kHz mono float32 PCM"""
+    # Optional dependency: pip install av
+    import av
+
+    chunks = []
+    resampler = av.AudioResampler(format='flt', layout='mono', rate=SAMPLE_RATE)
+    with av.open(io.BytesIO(audio_data)) as container:
+        for frame in container.decode(audio=0):
+            chunks.extend(resampled.to_ndarray().reshape(-1) for resampled in resampler.resample(frame))
+    chunks.extend(resampled.to_ndarray().reshape(-1) for resampled in resampler.resample(None))
+
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(chunks).astype(np.float32, copy=False)
+
+def _transcribe(model, audio: Union[str, np.ndarray]) -> str:
+    """Run the model with a pinned language, skipping per-clip detection when set"""
+    language = settings.WHISPER_LANGUAGE or None
+    if isinstance(model, WhisperCppTranscriber):
+        return model.transcribe(audio, language=language)['text'].strip()
+    # Voice notes are short single utterances: no fp16 on CPU, no timestamps,
+    # and no conditioning on earlier windows
+    return model.transcribe(
+        audio,
+        language=language,
+        task='transcribe',
+        fp16=False,
+        condition_on_previous_text=False,
+        without_timestamps=True
+    )['text'].strip()
+
+def transcribe_bytes(model, audio_data: bytes, filename: str = "audio.ogg") -> str:
+    """Transcribe audio bytes, decoding in memory when PyAV is available"""
+    try:
+        audio = decode_audio(audio_data)
+    except ImportError:
+        audio = None
+
+    if audio is not None:
+        return _transcribe(model, audio)
+
+    # Without PyAV, hand the backend a path for ffmpeg to decode, backed by memory
+    if hasattr(os, 'memfd_create'):
+        fd = os.memfd_create("wa_audio")
+        try:
+            os.write(fd, audio_data)
+            # ffmpeg runs as a child process, so address the fd through our pid
+            return _transcribe(model, f"/proc/{os.getpid()}/fd/{fd}")
+        finally:
+            os.close(fd)
+
+    temp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    with tempfile.NamedTemporaryFile(dir=temp_dir, suffix=os.path.splitext(filename)[1]) as temp_file:
+        temp_file.write(audio_data)
+        temp_file.flush()
+        return _transcribe(model, temp_file.name)
+
+# Model loaded once per transcription worker process
+_worker_model = None
+
+def init_whisper_worker(model_name: str, n_threads: int = None):
+    """ProcessPoolExecutor initializer: load the model in the worker"""
+    global _worker_model
+    _worker_model = load_whisper_model(model_name, n_threads=n_threads)
+
+def transcribe_in_worker(audio_data: bytes, filename: str = "audio.ogg") -> str:
+    """Transcribe with the worker's model; runs inside the process pool"""
+    return transcribe_bytes(_worker_model, audio_data, filename)
@@ -3,81 +3,182 @@ WhatsApp message handling via Puch AI
 """
 import asyncio
 import aiohttp
+import concurrent.futures
 import logging
-from typing import Dict, List, Optional, Any
+import multiprocessing
+import re
+from typing import Dict, List, Optional, Any, Tuple
 from datetime import datetime
-import whisper
-import tempfile
 import os
 from urllib.parse import urlparse
 import mimetypes
 
+import orjson
+from yarl import URL
+
 from config import settings
+from core.transcription_backend import init_whisper_worker, transcribe_in_worker
+
+try:
+    # Optional dependency: pip install selectolax (C lexbor HTML5 parser)
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    HTMLParser = None
+
+try:
+    # Optional dependency: pip install google-re2 (linear-time matching in C++)
+    import re2
+except ImportError:
+    re2 = None
 
 logger = logging.getLogger(__name__)
 
+if re2 is not None:
+    # RE2's \s is ASCII-only, so Python's Unicode whitespace is spelled out
+    _UNICODE_SPACE = r'\s\v\x1c-\x1f\x{85}\p{Z}'
+    _URL_RE = re2.compile(rf'https?://[^{_UNICODE_SPACE}<>"\']+')
+    _TAG_RE = re2.compile(r'<[^>]+>')
+    _WS_RE = re2.compile(rf'[{_UNICODE_SPACE}]+')
+else:
+    _URL_RE = re.compile(r'https?://[^\s<>"\']+')
+    _TAG_RE = re.compile(r'<[^>]+>')
+    _WS_RE = re.compile(r'\s+')
+
+# Only the head of a page is read; the preview keeps 1000 characters of text
+LINK_READ_BYTES = 256 * 1024
+LINK_TIMEOUT = aiohttp.ClientTimeout(total=10)
+MEDIA_CHUNK_BYTES = 64 * 1024
+
+def _html_to_text(html_content: str) -> str:
+    """Visible text of an HTML document with whitespace collapsed"""
+    if HTMLParser is None:
+        return _WS_RE.sub(' ', _TAG_RE.sub(' ', html_content)).strip()
+
+    tree = HTMLParser(html_content)
+    for node in tree.css('script, style'):
+        node.decompose()
+    root = tree.body or tree.root
+    if root is None:
+        return ''
+    return ' '.join(root.text(separator=' ').split())
+
+def _message_timestamp(value: Any, default: datetime) -> datetime:
+    """Sender timestamp as a datetime, from ISO text or epoch seconds"""
+    if isinstance(value, datetime):
+        return value
+    try:
+        if isinstance(value, (int, float)):
+            return datetime.fromtimestamp(value)
+        if isinstance(value, str) and value:
+            return datetime.fromisoformat(value)
+    except (ValueError, OverflowError, OSError):
+        logger.warning(f"Unparseable message timestamp: {value!r}")
+    return default
+
 class WhatsAppHandler:
     def __init__(self):
         self.base_url = settings.PUCH_AI_BASE_URL
         self.token = settings.PUCH_AI_TOKEN
         self.user_phone = settings.PUCH_USER_PHONE
-        self.whisper_model = whisper.load_model(settings.WHISPER_MODEL)
         
-        # Headers for API requests
+        # Whisper is CPU-bound, so voice notes transcribe in worker processes
+        # instead of blocking the event loop; each worker loads the model once
+        whisper_workers = max(1, settings.WHISPER_WORKERS)
+        self._whisper_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=whisper_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_whisper_worker,
+            initargs=(settings.WHISPER_MODEL, max(1, (os.cpu_count() or 1) // whisper_workers))
+        )
+        
+        # Headers and endpoints for API requests, built once; the JSON headers
+        # stay per request so the token never reaches link hosts
         self.headers = {
             'Authorization': f'Bearer {self.token}',
             'Content-Type': 'application/json'
         }
+        # Parsed once as yarl URLs, which aiohttp takes without re-parsing
+        base = URL(self.base_url)
+        self._messages_url = base / "messages"
+        self._send_url = base / "messages/send"
+        self._action_url = base / "messages/action"
+        
+        # One keep-alive session for every request, created on first use
+        self._session: Optional[aiohttp.ClientSession] = None
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Shared HTTP session; Puch AI auth headers are passed per request, never to link hosts"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=85, ttl_dns_cache=300)
+            )
+        return self._session
+    
+    async def shutdown(self):
+        """Close the HTTP session and stop the transcription workers"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._whisper_pool.shutdown(wait=False, cancel_futures=True)
     
     async def send_message(self, phone_number: str, message: str, message_type: str = 'text') -> bool:
         """Send a message via Puch AI"""
         try:
-            async with aiohttp.ClientSession() as session:
-                payload = {
-                    'phone': phone_number,
-                    'message': message,
-                    'type': message_type
-                }
-                
-                async with session.post(
-                    f"{self.base_url}/messages/send",
-                    json=payload,
-                    headers=self.headers
-                ) as response:
-                    if response.status == 200:
-                        logger.info(f"Message sent successfully to {phone_number}")
-                        return True
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Failed to send message: {response.status} - {error_text}")
-                        return False
-                        
+            session = await self._get_session()
+            payload = {
+                'phone': phone_number,
+                'message': message,
+                'type': message_type
+            }
+            
+            async with session.post(
+                self._send_url,
+                data=orjson.dumps(payload),
+                headers=self.headers
+            ) as response:
+                if response.status == 200:
+                    logger.info(f"Message sent successfully to {phone_number}")
+                    return True
+                else:
+                    error_text = await response.text()
+                    logger.error(f"Failed to send message: {response.status} - {error_text}")
+                    return False
+                    
         except Exception as e:
             logger.error(f"Error sending message: {e}")
             return False
     
+    async def send_messages_bulk(self, items: List[Tuple[str, str]], concurrency: int = 16) -> List[bool]:
+        """Send (phone_number, message) pairs concurrently over the shared session"""
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def send_one(phone_number: str, message: str) -> bool:
+            async with semaphore:
+                return await self.send_message(phone_number, message)
+        
+        return await asyncio.gather(*(send_one(phone, message) for phone, message in items))
+    
     async def get_messages(self, limit: int = 50) -> List[Dict]:
         """Get recent messages from Puch AI"""
         try:
-            async with aiohttp.ClientSession() as session:
-                params = {
-                    'limit': limit,
-                    'phone': self.user_phone
-                }
-                
-                async with session.get(
-                    f"{self.base_url}/messages",
-                    params=params,
-                    headers=self.headers
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get('messages', [])
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Failed to get messages: {response.status} - {error_text}")
-                        return []
-                        
+            session = await self._get_session()
+            params = {
+                'limit': limit,
+                'phone': self.user_phone
+            }
+            
+            async with session.get(
+                self._messages_url,
+                params=params,
+                headers=self.headers
+            ) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    return data.get('messages', [])
+                else:
+                    error_text = await response.text()
+                    logger.error(f"Failed to get messages: {response.status} - {error_text}")
+                    return []
+                    
         except Exception as e:
             logger.error(f"Error getting messages: {e}")
             return []
@@ -85,14 +186,26 @@ class WhatsAppHandler:
     async def download_media(self, media_url: str) -> Optional[bytes]:
         """Download media file from URL"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(media_url) as response:
-                    if response.status == 200:
-                        return await response.read()
-                    else:
-                        logger.error(f"Failed to download media: {response.status}")
+            session = await self._get_session()
+            async with session.get(media_url) as response:
+                if response.status == 200:
+                    max_bytes = settings.MAX_MEDIA_MB * 1024 * 1024
+                    if response.content_length and response.content_length > max_bytes:
+                        logger.warning(f"Media too large to download: {response.content_length} bytes")
                         return None
-                        
+                    
+                    # Chunked reads keep an oversized body without Content-Length bounded too
+                    buffer = bytearray()
+                    async for chunk in response.content.iter_chunked(MEDIA_CHUNK_BYTES):
+                        buffer.extend(chunk)
+                        if len(buffer) > max_bytes:
+                            logger.warning(f"Media too large to download: over {settings.MAX_MEDIA_MB} MB")
+                            return None
+                    return bytes(buffer)
+                else:
+                    logger.error(f"Failed to download media: {response.status}")
+                    return None
+                    
         except Exception as e:
             logger.error(f"Error downloading media: {e}")
             return None
@@ -100,23 +213,13 @@ class WhatsAppHandler:
     async def transcribe_audio(self, audio_data: bytes, filename: str = "audio.ogg") -> Optional[str]:
         """Transcribe audio using Whisper"""
         try:
-            # Save audio to temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as temp_file:
-                temp_file.write(audio_data)
-                temp_file_path = temp_file.name
+            # Decodes in memory, so no temporary file is written
+            transcription = await asyncio.get_running_loop().run_in_executor(
+                self._whisper_pool, transcribe_in_worker, audio_data, filename
+            )
             
-            try:
-                # Transcribe using Whisper
-                result = self.whisper_model.transcribe(temp_file_path)
-                transcription = result['text'].strip()
-                
-                logger.info(f"Audio transcribed successfully: {len(transcription)} characters")
-                return transcription
-                
-            finally:
-                # Clean up temporary file
-                if os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
+            logger.info(f"Audio transcribed successfully: {len(transcription)} characters")
+            return transcription
                     
         except Exception as e:
             logger.error(f"Error transcribing audio: {e}")
@@ -125,28 +228,32 @@ class WhatsAppHandler:
     async def extract_link_content(self, url: str) -> Optional[str]:
         """Extract content from a shared link"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=10) as response:
-                    if response.status == 200:
-                        content_type = response.headers.get('content-type', '').lower()
+            session = await self._get_session()
+            async with session.get(url, timeout=LINK_TIMEOUT) as response:
+                if response.status == 200:
+                    content_type = response.headers.get('content-type', '').lower()
+                    
+                    if 'text/html' in content_type:
+                        # read(n) returns after the first buffered chunk, so accumulate up to the cap
+                        raw = bytearray()
+                        async for chunk in response.content.iter_chunked(MEDIA_CHUNK_BYTES):
+                            raw.extend(chunk)
+                            if len(raw) >= LINK_READ_BYTES:
+                                del raw[LINK_READ_BYTES:]
+                                break
+                        html_content = bytes(raw).decode(response.charset or 'utf-8', errors='ignore')
+                        text_content = _html_to_text(html_content)
                         
-                        if 'text/html' in content_type:
-                            html_content = await response.text()
-                            # Simple text extraction (in production, use BeautifulSoup)
-                            import re
-                            text_content = re.sub(r'<[^>]+>', ' ', html_content)
-                            text_content = re.sub(r'\s+', ' ', text_content).strip()
-                            
-                            # Limit content length
-                            if len(text_content) > 1000:
-                                text_content = text_content[:1000] + "..."
-                            
-                            return f"Link content from {url}: {text_content}"
-                        else:
-                            return f"Link shared: {url} (Content type: {content_type})"
-                    else:
-                        return f"Link shared: {url} (Could not fetch content)"
+                        # Limit content length
+                        if len(text_content) > 1000:
+                            text_content = text_content[:1000] + "..."
                         
+                        return f"Link content from {url}: {text_content}"
+                    else:
+                        return f"Link shared: {url} (Content type: {content_type})"
+                else:
+                    return f"Link shared: {url} (Could not fetch content)"
+                    
         except Exception as e:
             logger.error(f"Error extracting link content: {e}")
             return f"Link shared: {url}"
@@ -156,9 +263,11 @@ class WhatsAppHandler:
         try:
             message_type = message.get('type', 'text')
             content = ""
+            # Kept as a datetime; orjson formats it when the metadata is serialized
+            now = datetime.now()
             metadata = {
                 'original_message': message,
-                'processed_at': datetime.now().isoformat(),
+                'processed_at': now,
                 'from_phone': message.get('from', ''),
                 'message_id': message.get('id', '')
             }
@@ -167,8 +276,7 @@ class WhatsAppHandler:
                 content = message.get('text', '')
                 
                 # Check for URLs in text
-                import re
-                urls = re.findall(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', content)
+                urls = _URL_RE.findall(content)
                 if urls:
                     # Extract content from first URL
                     link_content = await self.extract_link_content(urls[0])
@@ -229,7 +337,7 @@ class WhatsAppHandler:
                 'content': content,
                 'content_type': message_type,
                 'metadata': metadata,
-                'timestamp': message.get('timestamp', datetime.now().isoformat())
+                'timestamp': _message_timestamp(message.get('timestamp'), now)
             }
             
         except Exception as e:
@@ -238,25 +346,21 @@ class WhatsAppHandler:
                 'content': f"[Error processing {message.get('type', 'unknown')} message]",
                 'content_type': 'error',
                 'metadata': {'error': str(e)},
-                'timestamp': datetime.now().isoformat()
+                'timestamp': _message_timestamp(message.get('timestamp'), datetime.now())
             }
     
     async def send_typing_indicator(self, phone_number: str):
         """Send typing indicator"""
         try:
-            async with aiohttp.ClientSession() as session:
-                payload = {
-                    'phone': phone_number,
-                    'action': 'typing'
-                }
+            session = await self._get_session()
+            
+            async with session.post(
+                self._action_url,
+                data=orjson.dumps({'phone': phone_number, 'action': 'typing'}),
+                headers=self.headers
+            ) as response:
+                return response.status == 200
                 
-                async with session.post(
-                    f"{self.base_url}/messages/action",
-                    json=payload,
-                    headers=self.headers
-                ) as response:
-                    return response.status == 200
-                    
         except Exception as e:
             logger.error(f"Error sending typing indicator: {e}")
             return False
\ No newline at end of file
@@ -3,11 +3,20 @@ Echoself AI - The Reflective Personal Companion
 MCP Server compatible with Puch AI WhatsApp integration
 """
 import asyncio
+import hmac
 import os
 import logging
-from typing import Annotated, Optional, List, Dict, Any
+from typing import TYPE_CHECKING, Annotated, Optional, List, Dict, Any
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-import json
+
+import orjson
+
+try:
+    # Optional dependency: pip install uvloop (not available on Windows)
+    import uvloop
+except ImportError:
+    uvloop = None
 
 from dotenv import load_dotenv
 from fastmcp import FastMCP
@@ -15,16 +24,19 @@ from fastmcp.server.auth.providers.bearer import BearerAuthProvider, RSAKeyPair
 from mcp.server.auth.provider import AccessToken
 from mcp import ErrorData, McpError
 from mcp.types import TextContent, ImageContent, INVALID_PARAMS, INTERNAL_ERROR
-from pydantic import BaseModel, Field
+from pydantic import Field
 
 # Import our core modules
 import sys
 sys.path.append('..')
 from config import settings
-from core.memory_store import MemoryStore
-from core.llm_client import LLMClient
-from core.whatsapp_handler import WhatsAppHandler
-from core.reminder_system import ReminderSystem
+from core.query_cache import SemanticQueryCache
+
+if TYPE_CHECKING:
+    from core.memory_store import MemoryStore
+    from core.llm_client import LLMClient
+    from core.whatsapp_handler import WhatsAppHandler
+    from core.reminder_system import ReminderSystem
 
 # Load environment variables
 load_dotenv()
@@ -40,15 +52,44 @@ MY_NUMBER = os.environ.get("MY_NUMBER")
 assert TOKEN is not None, "Please set AUTH_TOKEN in your .env file"
 assert MY_NUMBER is not None, "Please set MY_NUMBER in your .env file"
 
+# Largest number of memories a single search may retrieve
+MAX_SEARCH_LIMIT = 20
+
+def _truncate(text: str, limit: int = 200) -> str:
+    """Text cut to limit characters, with an ellipsis when cut"""
+    return text if len(text) <= limit else f"{text[:limit]}..."
+
+def _text_response(response: Dict) -> TextContent:
+    """Tool response as indented JSON; datetimes serialize as ISO 8601"""
+    return TextContent(type="text", text=orjson.dumps(response, option=orjson.OPT_INDENT_2).decode())
+
+# The provider needs an RSA public key, but tokens are compared directly and
+# nothing is ever signed, so one key is generated once and only its public half kept
+AUTH_PUBLIC_KEY_FILE = "auth_public_key.pem"
+
+def _load_auth_public_key() -> str:
+    """Public key PEM from the data directory, generating it on first start"""
+    path = os.path.join(settings.DATA_DIR, AUTH_PUBLIC_KEY_FILE)
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        public_key = RSAKeyPair.generate().public_key
+        os.makedirs(settings.DATA_DIR, exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(public_key)
+        return public_key
+
 # Auth Provider
 class SimpleBearerAuthProvider(BearerAuthProvider):
     def __init__(self, token: str):
-        k = RSAKeyPair.generate()
-        super().__init__(public_key=k.public_key, jwks_uri=None, issuer=None, audience=None)
+        super().__init__(public_key=_load_auth_public_key(), jwks_uri=None, issuer=None, audience=None)
         self.token = token
+        self._token_bytes = token.encode()
 
     async def load_access_token(self, token: str) -> AccessToken | None:
-        if token == self.token:
+        # Constant-time compare so response timing doesn't reveal a matching prefix
+        if hmac.compare_digest(token.encode(), self._token_bytes):
             return AccessToken(
                 token=token,
                 client_id="echoself-client",
@@ -58,10 +99,20 @@ class SimpleBearerAuthProvider(BearerAuthProvider):
         return None
 
 # Rich Tool Description model
-class RichToolDescription(BaseModel):
+@dataclass(slots=True)
+class RichToolDescription:
     description: str
     use_when: str
     side_effects: str | None = None
+    # Serialized once; same compact JSON as pydantic's model_dump_json()
+    json: str = field(init=False, repr=False)
+    
+    def __post_init__(self):
+        self.json = orjson.dumps({
+            'description': self.description,
+            'use_when': self.use_when,
+            'side_effects': self.side_effects
+        }).decode()
 
 # Initialize MCP server
 mcp = FastMCP(
@@ -69,11 +120,14 @@ mcp = FastMCP(
     auth=SimpleBearerAuthProvider(TOKEN),
 )
 
-# Initialize core components
-memory_store = MemoryStore()
-llm_client = LLMClient()
-whatsapp_handler = WhatsAppHandler()
-reminder_system = ReminderSystem()
+# Core components, created by initialize_components() so importing this module
+# doesn't pull in torch, Whisper or the Qdrant client
+memory_store: Optional["MemoryStore"] = None
+llm_client: Optional["LLMClient"] = None
+whatsapp_handler: Optional["WhatsAppHandler"] = None
+reminder_system: Optional["ReminderSystem"] = None
+# Near-duplicate searches reuse the earlier reflection instead of a new search + LLM call
+query_cache = SemanticQueryCache()
 
 # Tool: validate (required by Puch AI)
 @mcp.tool
@@ -131,7 +185,7 @@ GET_REMINDERS_DESCRIPTION = RichToolDescription(
 )
 
 # Tool: store_message
-@mcp.tool(description=STORE_MESSAGE_DESCRIPTION.model_dump_json())
+@mcp.tool(description=STORE_MESSAGE_DESCRIPTION.json)
 async def store_message(
     puch_user_id: Annotated[str, Field(description="Puch User Unique Identifier")],
     content: Annotated[str, Field(description="Message content (text, transcription, or description)")],
@@ -140,54 +194,43 @@ async def store_message(
 ) -> List[TextContent]:
     """Store a message with sentiment analysis and embeddings"""
     try:
-        if not content or not content.strip():
+        content_text = (content or "").strip()
+        if not content_text:
             raise McpError(ErrorData(code=INVALID_PARAMS, message="Content cannot be empty"))
         
         # Store the memory
-        memory_id = await memory_store.store_memory(
-            content=content.strip(),
+        memory_id, sentiment = await memory_store.store_memory(
+            content=content_text,
             content_type=message_type,
             metadata={
                 **(metadata or {}),
                 'user_id': puch_user_id,
-                'stored_at': datetime.now().isoformat()
+                'stored_at': datetime.now()
             }
         )
         
-        # Get the stored memory for response
-        memories = await memory_store.search_memories(content, limit=1)
-        if memories:
-            memory = memories[0]
-            sentiment = memory.sentiment_analysis
-            
-            response = {
-                "memory_id": memory_id,
-                "message": "Memory stored successfully",
-                "sentiment_analysis": {
-                    "sentiment": sentiment.get('sentiment', 'neutral'),
-                    "mood": sentiment.get('mood', 'neutral'),
-                    "emotions": sentiment.get('emotions', []),
-                    "confidence": sentiment.get('confidence', 0.0)
-                },
-                "content_type": message_type
-            }
-        else:
-            response = {
-                "memory_id": memory_id,
-                "message": "Memory stored successfully",
-                "content_type": message_type
-            }
+        response = {
+            "memory_id": memory_id,
+            "message": "Memory stored successfully",
+            "sentiment_analysis": {
+                "sentiment": sentiment.get('sentiment', 'neutral'),
+                "mood": sentiment.get('mood', 'neutral'),
+                "emotions": sentiment.get('emotions', []),
+                "confidence": sentiment.get('confidence', 0.0)
+            },
+            "content_type": message_type
+        }
         
-        return [TextContent(type="text", text=json.dumps(response, indent=2))]
+        return [_text_response(response)]
         
     except McpError:
         raise
     except Exception as e:
-        logger.error(f"Error storing message: {e}")
+        logger.error("Error storing message: %s", e)
         raise McpError(ErrorData(code=INTERNAL_ERROR, message=str(e)))
 
 # Tool: search_memories
-@mcp.tool(description=SEARCH_MEMORIES_DESCRIPTION.model_dump_json())
+@mcp.tool(description=SEARCH_MEMORIES_DESCRIPTION.json)
 async def search_memories(
     puch_user_id: Annotated[str, Field(description="Puch User Unique Identifier")],
     query: Annotated[str, Field(description="Natural language query to search memories")],
@@ -196,15 +239,26 @@ async def search_memories(
 ) -> List[TextContent]:
     """Search memories and generate reflective insights"""
     try:
-        if not query or not query.strip():
+        query_text = (query or "").strip()
+        if not query_text:
             raise McpError(ErrorData(code=INVALID_PARAMS, message="Query cannot be empty"))
         
+        # Clamp rather than reject, so any limit maps to a bounded search
+        limit = min(MAX_SEARCH_LIMIT, max(1, limit))
+        
         # Add user filter
         search_filters = filters or {}
         # Note: In a real implementation, you'd filter by user_id in the vector DB
         
+        # A similar recent query with the same options already has a response
+        query_embedding = await memory_store.embed_query(query_text)
+        cache_params = (limit, orjson.dumps(search_filters, option=orjson.OPT_SORT_KEYS))
+        cached = query_cache.get(puch_user_id, query_embedding, cache_params)
+        if cached is not None:
+            return cached
+        
         # Search for relevant memories
-        memories = await memory_store.search_memories(query.strip(), limit=limit, filters=search_filters)
+        memories = await memory_store.search_memories(query_text, limit=limit, filters=search_filters)
         
         if not memories:
             return [TextContent(type="text", text="I couldn't find any relevant memories for your query. Try asking about something else or share more experiences with me first.")]
@@ -216,37 +270,49 @@ async def search_memories(
                 'content': memory.content,
                 'timestamp': memory.timestamp.isoformat(),
                 'sentiment_analysis': memory.sentiment_analysis,
-                'content_type': memory.content_type
+                'content_type': memory.content_type,
+                'embedding': memory.embedding
             })
         
-        # Generate reflection using LLM
-        reflection = await llm_client.generate_reflection(query, memory_dicts)
-        
-        # Prepare response
+        # Generate reflection using LLM; a fallback is shown but never cached
+        try:
+            reflection = await llm_client.generate_reflection(query, memory_dicts)
+            reflection_ok = True
+        except Exception as e:
+            from core.llm_client import REFLECTION_FALLBACK
+            logger.error("Error generating reflection: %s", e)
+            reflection = REFLECTION_FALLBACK
+            reflection_ok = False
+        
+        # The reflection goes out as its own text block, ahead of the JSON details,
+        # so it isn't escaped and indented into the envelope
+        top_memories = memories[:3]  # Show top 3 memories
         response = {
-            "reflection": reflection,
             "memories_found": len(memories),
             "query": query,
             "relevant_memories": [
                 {
-                    "content": memory.content[:200] + "..." if len(memory.content) > 200 else memory.content,
-                    "timestamp": memory.timestamp.isoformat(),
+                    "content": _truncate(memory.content),
+                    "timestamp": memory.timestamp,
                     "mood": memory.sentiment_analysis.get('mood', 'neutral')
                 }
-                for memory in memories[:3]  # Show top 3 memories
+                for memory in top_memories
             ]
         }
         
-        return [TextContent(type="text", text=json.dumps(response, indent=2))]
+        result = [TextContent(type="text", text=reflection), _text_response(response)]
+        if reflection_ok:
+            query_cache.put(puch_user_id, query_embedding, result, cache_params)
+        return result
         
     except McpError:
         raise
     except Exception as e:
-        logger.error(f"Error searching memories: {e}")
+        logger.error("Error searching memories: %s", e)
         raise McpError(ErrorData(code=INTERNAL_ERROR, message=str(e)))
 
 # Tool: summarize_mood
-@mcp.tool(description=SUMMARIZE_MOOD_DESCRIPTION.model_dump_json())
+@mcp.tool(description=SUMMARIZE_MOOD_DESCRIPTION.json)
 async def summarize_mood(
     puch_user_id: Annotated[str, Field(description="Puch User Unique Identifier")],
     days: Annotated[int, Field(description="Number of days to analyze")] = 7
@@ -279,16 +345,16 @@ async def summarize_mood(
             }
         }
         
-        return [TextContent(type="text", text=json.dumps(response, indent=2))]
+        return [_text_response(response)]
         
     except McpError:
         raise
     except Exception as e:
-        logger.error(f"Error summarizing mood: {e}")
+        logger.error("Error summarizing mood: %s", e)
         raise McpError(ErrorData(code=INTERNAL_ERROR, message=str(e)))
 
 # Tool: set_reminder
-@mcp.tool(description=SET_REMINDER_DESCRIPTION.model_dump_json())
+@mcp.tool(description=SET_REMINDER_DESCRIPTION.json)
 async def set_reminder(
     puch_user_id: Annotated[str, Field(description="Puch User Unique Identifier")],
     content: Annotated[str, Field(description="What to remind about")],
@@ -297,52 +363,59 @@ async def set_reminder(
 ) -> List[TextContent]:
     """Set a reminder using natural language time parsing"""
     try:
-        if not content or not content.strip():
+        content_text = (content or "").strip()
+        if not content_text:
             raise McpError(ErrorData(code=INVALID_PARAMS, message="Reminder content cannot be empty"))
         
-        if not time_text or not time_text.strip():
+        time_spec = (time_text or "").strip()
+        if not time_spec:
             raise McpError(ErrorData(code=INVALID_PARAMS, message="Time specification cannot be empty"))
         
         # Create the reminder
-        reminder_id = await reminder_system.create_reminder(
+        reminder = await reminder_system.create_reminder(
             user_id=puch_user_id,
-            content=content.strip(),
-            time_text=time_text.strip(),
+            content=content_text,
+            time_text=time_spec,
             metadata=metadata
         )
         
-        if not reminder_id:
+        if not reminder:
             raise McpError(ErrorData(code=INVALID_PARAMS, message=f"Could not parse time: '{time_text}'. Try formats like 'tomorrow at 9am', 'in 2 hours', or 'next Monday at 3pm'"))
         
-        # Get the created reminder for confirmation
-        user_reminders = await reminder_system.get_user_reminders(puch_user_id)
-        created_reminder = next((r for r in user_reminders if r.id == reminder_id), None)
-        
-        if created_reminder:
-            response = {
-                "message": "Reminder set successfully!",
-                "reminder_id": reminder_id,
-                "content": content.strip(),
-                "scheduled_time": created_reminder.scheduled_time.isoformat(),
-                "time_until_reminder": str(created_reminder.scheduled_time - datetime.now())
-            }
-        else:
-            response = {
-                "message": "Reminder set successfully!",
-                "reminder_id": reminder_id,
-                "content": content.strip()
-            }
+        response = {
+            "message": "Reminder set successfully!",
+            "reminder_id": reminder.id,
+            "content": reminder.content,
+            "scheduled_time": reminder.scheduled_time,
+            # Measured from creation, a moment ago, rather than reading the clock again
+            "time_until_reminder": str(reminder.scheduled_time - reminder.created_at)
+        }
         
-        return [TextContent(type="text", text=json.dumps(response, indent=2))]
+        return [_text_response(response)]
         
     except McpError:
         raise
     except Exception as e:
-        logger.error(f"Error setting reminder: {e}")
+        logger.error("Error setting reminder: %s", e)
         raise McpError(ErrorData(code=INTERNAL_ERROR, message=str(e)))
 
+def _reminder_info(reminder, now: datetime) -> Dict:
+    """Response entry for a reminder, with whole-second time remaining if pending"""
+    reminder_info = {
+        "id": reminder.id,
+        "content": reminder.content,
+        "scheduled_time": reminder.scheduled_time,
+        "status": "sent" if reminder.is_sent else "pending",
+        "created_at": reminder.created_at
+    }
+    
+    time_until = reminder.scheduled_time - now
+    if not reminder.is_sent and time_until > timedelta(0):
+        reminder_info["time_until"] = str(timedelta(time_until.days, time_until.seconds))
+    return reminder_info
+
 # Tool: get_reminders
-@mcp.tool(description=GET_REMINDERS_DESCRIPTION.model_dump_json())
+@mcp.tool(description=GET_REMINDERS_DESCRIPTION.json)
 async def get_reminders(
     puch_user_id: Annotated[str, Field(description="Puch User Unique Identifier")],
     include_sent: Annotated[bool, Field(description="Include already sent reminders")] = False
@@ -355,58 +428,92 @@ async def get_reminders(
             message = "You don't have any active reminders." if not include_sent else "You don't have any reminders."
             return [TextContent(type="text", text=message)]
         
-        reminder_list = []
-        for reminder in reminders:
-            time_until = reminder.scheduled_time - datetime.now()
-            status = "sent" if reminder.is_sent else "pending"
-            
-            reminder_info = {
-                "id": reminder.id,
-                "content": reminder.content,
-                "scheduled_time": reminder.scheduled_time.isoformat(),
-                "status": status,
-                "created_at": reminder.created_at.isoformat()
-            }
-            
-            if not reminder.is_sent and time_until.total_seconds() > 0:
-                reminder_info["time_until"] = str(time_until)
-            
-            reminder_list.append(reminder_info)
+        now = datetime.now()
+        reminder_list = [_reminder_info(reminder, now) for reminder in reminders]
+        # Without include_sent every reminder returned is still pending
+        active_reminders = sum(not r.is_sent for r in reminders) if include_sent else len(reminders)
         
         response = {
             "total_reminders": len(reminders),
-            "active_reminders": len([r for r in reminders if not r.is_sent]),
+            "active_reminders": active_reminders,
             "reminders": reminder_list
         }
         
-        return [TextContent(type="text", text=json.dumps(response, indent=2))]
+        return [_text_response(response)]
         
     except Exception as e:
-        logger.error(f"Error getting reminders: {e}")
+        logger.error("Error getting reminders: %s", e)
         raise McpError(ErrorData(code=INTERNAL_ERROR, message=str(e)))
 
 # Reminder callback for WhatsApp notifications
-async def reminder_callback(reminder):
-    """Send reminder via WhatsApp"""
+async def reminder_callback(reminders):
+    """Send the reminders due in one checker pass via WhatsApp"""
     try:
-        # Generate personalized reminder message
-        reminder_message = await llm_client.generate_reminder_message(
-            reminder.content,
-            context=f"Reminder set on {reminder.created_at.strftime('%Y-%m-%d')}"
-        )
+        # Generate personalized reminder messages concurrently
+        reminder_messages = await asyncio.gather(*(
+            llm_client.generate_reminder_message(
+                reminder.content,
+                context=f"Reminder set on {reminder.created_at.strftime('%Y-%m-%d')}"
+            )
+            for reminder in reminders
+        ))
         
         # In a real implementation, you would send this via WhatsApp
         # For now, we'll just log it
-        logger.info(f"Reminder for user {reminder.user_id}: {reminder_message}")
+        for reminder, reminder_message in zip(reminders, reminder_messages):
+            logger.info("Reminder for user %s: %s", reminder.user_id, reminder_message)
         
-        # You could integrate with Puch AI here to send the actual WhatsApp message
-        # await whatsapp_handler.send_message(reminder.user_id, reminder_message)
+        # You could integrate with Puch AI here to send the actual WhatsApp messages
+        # await whatsapp_handler.send_messages_bulk(
+        #     [(reminder.user_id, message) for reminder, message in zip(reminders, reminder_messages)]
+        # )
         
     except Exception as e:
-        logger.error(f"Error sending reminder: {e}")
+        logger.error("Error sending reminder: %s", e)
 
-# Register reminder callback
-reminder_system.add_reminder_callback(reminder_callback)
+def write_error_callback(error, points):
+    """Report memories the write-behind queue could not store after retrying"""
+    logger.error(
+        "Lost %d memories that were reported as stored (%s): %s",
+        len(points), ", ".join(str(point.id) for point in points), error
+    )
+
+def _create_memory_components():
+    """MemoryStore and the LLMClient that shares its embedding model"""
+    from core.memory_store import MemoryStore
+    from core.llm_client import LLMClient
+    
+    store = MemoryStore()
+    return store, LLMClient(embedding_model=store.embedding_model, embed_texts=store.embed_texts)
+
+def _create_whatsapp_handler():
+    from core.whatsapp_handler import WhatsAppHandler
+    return WhatsAppHandler()
+
+def _create_reminder_system():
+    from core.reminder_system import ReminderSystem
+    return ReminderSystem()
+
+async def initialize_components():
+    """Import and create the core components and register the reminder callback"""
+    global memory_store, llm_client, whatsapp_handler, reminder_system
+    
+    # Model loading, the reminder snapshot and the Whisper pool are independent,
+    # so startup takes as long as the slowest rather than the sum
+    (memory_store, llm_client), whatsapp_handler, reminder_system = await asyncio.gather(
+        asyncio.to_thread(_create_memory_components),
+        asyncio.to_thread(_create_whatsapp_handler),
+        asyncio.to_thread(_create_reminder_system)
+    )
+    
+    # Register reminder callback
+    reminder_system.add_reminder_batch_callback(reminder_callback)
+    
+    # Writes are acknowledged before they reach Qdrant, so failures surface here
+    memory_store.on_write_error = write_error_callback
+    # Searches aren't scoped to a user yet, so a new memory can change anyone's
+    # results; invalidating once it is searchable keeps stale results out of the cache
+    memory_store.on_write_complete = lambda points: query_cache.invalidate()
 
 # Run MCP Server
 async def main():
@@ -414,7 +521,18 @@ async def main():
     print("🔗 Ready for Puch AI WhatsApp integration")
     print("📱 Connect via: /mcp connect <your-https-url> <your-bearer-token>")
     
-    await mcp.run_async("streamable-http", host="0.0.0.0", port=8086)
+    await initialize_components()
+    reminder_system.start()
+    try:
+        await mcp.run_async("streamable-http", host="0.0.0.0", port=8086)
+    finally:
+        await reminder_system.stop()
+        await whatsapp_handler.shutdown()
+        await memory_store.shutdown()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if uvloop is not None:
+        # libuv event loop for the aiohttp and MCP stream fan-out
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
\ No newline at end of file
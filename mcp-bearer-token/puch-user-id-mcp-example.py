@@ -3,9 +3,10 @@
 
 import asyncio
 from typing import Annotated, Optional, Literal
-import os, uuid, json
+import os, uuid
 from datetime import datetime
 from dotenv import load_dotenv
+import orjson
 
 from fastmcp import FastMCP
 from fastmcp.server.auth.providers.bearer import BearerAuthProvider, RSAKeyPair
@@ -64,6 +65,10 @@ def _error(code, msg):
     raise McpError(ErrorData(code=code, message=msg))
 
 
+def _dumps(obj) -> str:
+    return orjson.dumps(obj).decode()
+
+
 # --- Rich Tool Description model ---
 class RichToolDescription(BaseModel):
     description: str
@@ -139,7 +144,7 @@ async def add_task(
             "updated_at": now,
         }
         user_tasks[tid] = task
-        return [TextContent(type="text", text=json.dumps(task))]
+        return [TextContent(type="text", text=_dumps(task))]
     except McpError:
         raise
     except Exception as e:
@@ -174,7 +179,7 @@ async def list_tasks(
         tasks.sort(
             key=lambda t: (t.get("due_at") or "9999", t["created_at"])
         )  # simple sort
-        return [TextContent(type="text", text=json.dumps(tasks))]
+        return [TextContent(type="text", text=_dumps(tasks))]
     except Exception as e:
         _error(INTERNAL_ERROR, str(e))
 
@@ -188,7 +193,7 @@ async def get_task(
         t = _user_tasks(puch_user_id).get(task_id)
         if not t:
             _error(INVALID_PARAMS, f"No task {task_id} for user")
-        return [TextContent(type="text", text=json.dumps(t))]
+        return [TextContent(type="text", text=_dumps(t))]
     except McpError:
         raise
     except Exception as e:
@@ -207,7 +212,7 @@ async def complete_task(
             _error(INVALID_PARAMS, f"No task {task_id} for user")
         t["status"] = "completed"
         t["updated_at"] = _now()
-        return [TextContent(type="text", text=json.dumps(t))]
+        return [TextContent(type="text", text=_dumps(t))]
     except McpError:
         raise
     except Exception as e:
@@ -224,7 +229,7 @@ async def remove_task(
         if task_id not in user_tasks:
             _error(INVALID_PARAMS, f"No task {task_id} for user")
         del user_tasks[task_id]
-        return [TextContent(type="text", text=json.dumps({"removed": task_id}))]
+        return [TextContent(type="text", text=_dumps({"removed": task_id}))]
     except McpError:
         raise
     except Exception as e:
@@ -0,0 +1,110 @@
+"""
+Tests for memory encryption
+"""
+import base64
+import pytest
+from core.encryption import MemoryEncryption, load_encryption, migrate_legacy_token
+
+@pytest.fixture
+def encryption():
+    return MemoryEncryption("test-password")
+
+def test_encrypt_decrypt_roundtrip(encryption):
+    """Test that encrypted data decrypts to the original"""
+    text = "A private thought 🌙"
+    encrypted = encryption.encrypt_data(text)
+
+    assert encrypted != text
+    assert encryption.decrypt_data(encrypted) == text
+
+def test_encrypt_json_roundtrip(encryption):
+    """Test JSON encryption round-trip"""
+    data = {"user_id": "abc", "tags": ["a", "b"], "count": 3}
+    encrypted = encryption.encrypt_json(data)
+
+    assert encryption.decrypt_json(encrypted) == data
+
+def test_same_password_same_key():
+    """Test that the same password derives the same key"""
+    first = MemoryEncryption("shared-password")
+    second = MemoryEncryption("shared-password")
+
+    assert first.key == second.key
+    assert second.decrypt_data(first.encrypt_data("hello")) == "hello"
+
+def test_key_string_roundtrip(encryption):
+    """Test restoring an instance from its key string"""
+    restored = MemoryEncryption.from_key_string(encryption.get_key_string())
+
+    assert restored.decrypt_data(encryption.encrypt_data("hello")) == "hello"
+
+def test_unlock_wrapped_key(encryption):
+    """Test unwrapping a password-protected data key"""
+    salt = b"0123456789abcdef"
+    wrapped = encryption.wrap_key("test-password", salt)
+    unlocked = MemoryEncryption.unlock("test-password", salt, wrapped)
+
+    assert unlocked.key == encryption.key
+    with pytest.raises(ValueError):
+        MemoryEncryption.unlock("wrong-password", salt, wrapped)
+
+def test_load_encryption_persists_key(tmp_path, monkeypatch):
+    """Test that the wrapped key file is provisioned once and reused"""
+    monkeypatch.setenv("ECHOSELF_SKIP_KEYRING", "1")
+    key_file = str(tmp_path / "memory_key.json")
+    first = load_encryption("test-password", key_file)
+    second = load_encryption("test-password", key_file)
+
+    assert (tmp_path / "memory_key.json").exists()
+    assert second.decrypt_data(first.encrypt_data("hello")) == "hello"
+
+def test_decrypt_legacy_double_encoded_token(encryption):
+    """Test that tokens stored with the old outer base64 layer still decrypt"""
+    token = encryption.encrypt_data("hello")
+    legacy = base64.urlsafe_b64encode(token.encode()).decode()
+
+    assert migrate_legacy_token(legacy) == token
+    assert encryption.decrypt_data(legacy) == "hello"
+
+def test_bulk_roundtrip(encryption):
+    """Test bulk AES-GCM encryption of many records"""
+    records = [{"id": str(i), "content": f"memory {i}"} for i in range(50)]
+    blob = encryption.encrypt_bulk(records)
+
+    assert isinstance(blob, bytes)
+    assert encryption.decrypt_bulk(blob) == records
+    with pytest.raises(ValueError):
+        MemoryEncryption("other-password").decrypt_bulk(blob)
+
+def test_key_file_written_owner_only(tmp_path, monkeypatch):
+    """Test that the provisioned key file is private and leaves no temp file"""
+    monkeypatch.setenv("ECHOSELF_SKIP_KEYRING", "1")
+    key_file = tmp_path / "memory_key.json"
+    load_encryption("test-password", str(key_file))
+
+    assert key_file.stat().st_mode & 0o777 == 0o600
+    assert not (tmp_path / "memory_key.json.tmp").exists()
+
+def test_keyring_cache_ignored_after_password_change(tmp_path, monkeypatch):
+    """Test that a cached keychain key is not reused with a different password"""
+    stored = {}
+
+    class FakeKeyring:
+        @staticmethod
+        def get_password(service, username):
+            return stored.get((service, username))
+
+        @staticmethod
+        def set_password(service, username, password):
+            stored[(service, username)] = password
+
+    monkeypatch.delenv("ECHOSELF_SKIP_KEYRING", raising=False)
+    monkeypatch.setattr("core.encryption.keyring", FakeKeyring)
+    key_file = str(tmp_path / "memory_key.json")
+    first = load_encryption("test-password", key_file)
+    cached = load_encryption("test-password", key_file)
+
+    assert len(stored) == 1
+    assert cached.key == first.key
+    with pytest.raises(ValueError):
+        load_encryption("other-password", key_file)
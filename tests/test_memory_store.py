@@ -20,10 +20,11 @@ async def test_store_memory(memory_store):
     content_type = "text"
     metadata = {"test": True}
     
-    memory_id = await memory_store.store_memory(content, content_type, metadata)
+    memory_id, sentiment = await memory_store.store_memory(content, content_type, metadata)
     
     assert memory_id is not None
     assert isinstance(memory_id, str)
+    assert sentiment['sentiment'] in ('positive', 'negative', 'neutral')
 
 @pytest.mark.asyncio
 async def test_search_memories(memory_store):
@@ -47,4 +48,13 @@ async def test_mood_summary(memory_store):
     
     mood_summary = await memory_store.get_mood_summary(days=1)
     
-    assert isinstance(mood_summary, dict)
\ No newline at end of file
+    assert isinstance(mood_summary, dict)
+@pytest.mark.asyncio
+async def test_shutdown_flushes_pending_writes(memory_store):
+    """Test that shutdown drains the write-behind queue"""
+    await memory_store.store_memory("Written just before exit", "text")
+    
+    await memory_store.shutdown()
+    
+    assert memory_store._write_queue.empty()
+    assert memory_store._writer_task.done()
@@ -0,0 +1,44 @@
+"""
+Tests for the semantic query cache
+"""
+import numpy as np
+import pytest
+from core.query_cache import SemanticQueryCache
+
+@pytest.fixture
+def query_cache():
+    return SemanticQueryCache(threshold=0.9, max_entries=2)
+
+def test_similar_query_hits(query_cache):
+    """Test that a near-identical embedding returns the cached value"""
+    query_cache.put("user", np.array([1.0, 0.0, 0.0]), "response", params=5)
+
+    assert query_cache.get("user", np.array([0.99, 0.05, 0.0]), params=5) == "response"
+    assert query_cache.get("user", np.array([0.0, 1.0, 0.0]), params=5) is None
+
+def test_params_and_users_are_separate(query_cache):
+    """Test that other options and other users never share a value"""
+    query_cache.put("user", np.array([1.0, 0.0]), "response", params=5)
+
+    assert query_cache.get("user", np.array([1.0, 0.0]), params=3) is None
+    assert query_cache.get("other", np.array([1.0, 0.0]), params=5) is None
+
+def test_lru_eviction_and_invalidate(query_cache):
+    """Test that the least recently used entry is evicted and invalidate clears"""
+    query_cache.put("user", np.array([1.0, 0.0, 0.0]), "first")
+    query_cache.put("user", np.array([0.0, 1.0, 0.0]), "second")
+    assert query_cache.get("user", np.array([1.0, 0.0, 0.0])) == "first"
+    query_cache.put("user", np.array([0.0, 0.0, 1.0]), "third")
+
+    assert query_cache.get("user", np.array([0.0, 1.0, 0.0])) is None
+    assert query_cache.get("user", np.array([1.0, 0.0, 0.0])) == "first"
+
+    query_cache.invalidate()
+    assert query_cache.get("user", np.array([1.0, 0.0, 0.0])) is None
+
+def test_expired_entries_miss():
+    """Test that entries older than the TTL are not returned"""
+    query_cache = SemanticQueryCache(ttl=-1)
+    query_cache.put("user", np.array([1.0, 0.0]), "response")
+
+    assert query_cache.get("user", np.array([1.0, 0.0])) is None
@@ -4,12 +4,32 @@ Tests for reminder system
 import pytest
 import asyncio
 from datetime import datetime, timedelta
-from core.reminder_system import ReminderSystem
+from types import SimpleNamespace
+import dateparser
+from core.reminder_system import DATEPARSER_SETTINGS, ReminderSystem, _parse_common_time
 
 @pytest.fixture
 def reminder_system():
     return ReminderSystem()
 
+@pytest.fixture
+def reminder_data_dir(tmp_path, monkeypatch):
+    """Point the reminder snapshot and journal at a temporary directory"""
+    monkeypatch.setattr("core.reminder_system.settings", SimpleNamespace(DATA_DIR=str(tmp_path)))
+    return tmp_path
+
+@pytest.fixture
+def tmp_reminder_system(reminder_data_dir):
+    return ReminderSystem()
+
+async def _wait_until(predicate, timeout: float = 5.0):
+    """Poll predicate until it holds, failing after timeout seconds"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        assert loop.time() < deadline, "condition not met before timeout"
+        await asyncio.sleep(0.01)
+
 def test_parse_reminder_time(reminder_system):
     """Test time parsing"""
     # Test various time formats
@@ -33,10 +53,11 @@ async def test_create_reminder(reminder_system):
     content = "Test reminder"
     time_text = "in 1 hour"
     
-    reminder_id = await reminder_system.create_reminder(user_id, content, time_text)
+    reminder = await reminder_system.create_reminder(user_id, content, time_text)
     
-    if reminder_id:  # Might be None if time parsing fails
-        assert isinstance(reminder_id, str)
+    if reminder:  # Might be None if time parsing fails
+        assert isinstance(reminder.id, str)
+        assert reminder.content == content
         
         # Check if reminder was created
         reminders = await reminder_system.get_user_reminders(user_id)
@@ -51,4 +72,102 @@ async def test_get_user_reminders(reminder_system):
     await reminder_system.create_reminder(user_id, "Test", "tomorrow")
     
     reminders = await reminder_system.get_user_reminders(user_id)
-    assert isinstance(reminders, list)
\ No newline at end of file
+    assert isinstance(reminders, list)
+
+@pytest.mark.asyncio
+async def test_journal_replay(reminder_data_dir):
+    """Test that journaled creates and cancels survive a restart and compaction"""
+    first = ReminderSystem()
+    kept = (await first.create_reminder("test_user", "Keep", "in 2 hours")).id
+    dropped = (await first.create_reminder("test_user", "Drop", "in 3 hours")).id
+    await first.cancel_reminder(dropped, "test_user")
+    await first.flush()
+    
+    restored = ReminderSystem()
+    assert list(restored.reminders) == [kept]
+    
+    await restored.stop()
+    assert (reminder_data_dir / "reminders.journal").read_bytes() == b""
+    assert list(ReminderSystem().reminders) == [kept]
+
+@pytest.mark.asyncio
+async def test_user_reminders_sorted_per_user(tmp_reminder_system):
+    """Test that each user's reminders come back in due order"""
+    reminder_system = tmp_reminder_system
+    later = (await reminder_system.create_reminder("user_a", "Later", "in 3 hours")).id
+    sooner = (await reminder_system.create_reminder("user_a", "Sooner", "in 1 hour")).id
+    other = (await reminder_system.create_reminder("user_b", "Other", "in 2 hours")).id
+    
+    assert [r.id for r in await reminder_system.get_user_reminders("user_a")] == [sooner, later]
+    assert [r.id for r in await reminder_system.get_user_reminders("user_b")] == [other]
+    
+    await reminder_system.cancel_reminder(sooner, "user_a")
+    assert [r.id for r in await reminder_system.get_user_reminders("user_a")] == [later]
+
+@pytest.mark.asyncio
+async def test_checker_writes_queued_changes(reminder_data_dir, tmp_reminder_system):
+    """Test that the running checker writes a burst of changes to the journal"""
+    reminder_system = tmp_reminder_system
+    journal = reminder_data_dir / "reminders.journal"
+    reminder_system.start()
+    for i in range(3):
+        await reminder_system.create_reminder("test_user", f"Reminder {i}", "in 2 hours")
+    
+    await _wait_until(lambda: journal.exists() and len(journal.read_bytes().splitlines()) == 3)
+    await reminder_system.stop()
+
+def test_common_time_fast_path_matches_dateparser():
+    """Test that the regex fast path agrees with dateparser"""
+    now = datetime.now()
+    for time_text in ["in 5 minutes", "in an hour", "in 3 days", "in 2 weeks", "tomorrow",
+                      "tomorrow at 9am", "at 9:30 pm", "at 21:15", "today at 8pm", "at 12pm"]:
+        expected = dateparser.parse(time_text, settings={**DATEPARSER_SETTINGS, 'RELATIVE_BASE': now})
+        parsed = _parse_common_time(time_text, now)
+        
+        # parse_reminder_time rolls past clock times to tomorrow either way
+        assert parsed.time() == expected.time()
+        assert parsed.date() in (expected.date(), expected.date() - timedelta(days=1))
+    
+    assert _parse_common_time("next friday at 3pm", now).weekday() == 4
+    assert _parse_common_time("at 13pm", now) is None
+
+@pytest.mark.asyncio
+async def test_due_reminder_fires_callback(tmp_reminder_system):
+    """Test that the checker fires a due reminder once and marks it sent"""
+    reminder_system = tmp_reminder_system
+    fired = []
+    done = asyncio.Event()
+    
+    async def callback(reminder):
+        fired.append(reminder.id)
+        done.set()
+    
+    reminder_system.add_reminder_callback(callback)
+    reminder_system.start()
+    reminder_id = (await reminder_system.create_reminder("test_user", "Soon", "in 1 second")).id
+    await asyncio.wait_for(done.wait(), timeout=5)
+    
+    assert fired == [reminder_id]
+    assert reminder_system.reminders[reminder_id].is_sent
+    await reminder_system.stop()
+
+@pytest.mark.asyncio
+async def test_batch_callback_gets_all_due_reminders(tmp_reminder_system):
+    """Test that reminders due in the same pass reach a batch callback together"""
+    reminder_system = tmp_reminder_system
+    batches = []
+    done = asyncio.Event()
+    
+    async def callback(reminders):
+        batches.append([reminder.id for reminder in reminders])
+        done.set()
+    
+    reminder_system.add_reminder_batch_callback(callback)
+    first = (await reminder_system.create_reminder("test_user", "First", "in 1 second")).id
+    second = (await reminder_system.create_reminder("other_user", "Second", "in 1 second")).id
+    await asyncio.sleep(1.1)
+    reminder_system.start()
+    await asyncio.wait_for(done.wait(), timeout=5)
+    
+    assert sorted(batches[0]) == sorted([first, second])
+    await reminder_system.stop()
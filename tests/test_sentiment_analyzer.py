@@ -1,8 +1,9 @@
 """
 Tests for sentiment analyzer
 """
+import numpy as np
 import pytest
-from core.sentiment_analyzer import SentimentAnalyzer, SentimentResult
+from core.sentiment_analyzer import MOOD_INDEX, SENTIMENT_INDEX, SentimentAnalyzer, SentimentResult
 
 @pytest.fixture
 def analyzer():
@@ -66,4 +67,37 @@ def test_mood_patterns(analyzer):
     assert "mood_distribution" in patterns
     assert "sentiment_distribution" in patterns
     assert "dominant_mood" in patterns
-    assert patterns["total_messages"] == 2
\ No newline at end of file
+    assert patterns["total_messages"] == 2
+
+def test_mood_arrays_match_mood_patterns(analyzer):
+    """Test that the array-based summary matches the dict-based one"""
+    messages = [
+        {
+            "timestamp": f"2024-01-{day:02d}T10:00:00",
+            "sentiment_analysis": {"sentiment": sentiment, "mood": mood}
+        }
+        for day in range(1, 20)
+        for sentiment, mood in [("positive", "happy"), ("negative", "sad")] + ([("positive", "grateful")] if day > 12 else [])
+    ]
+    days = np.array([19723 + int(m["timestamp"][8:10]) - 1 for m in messages])  # 19723 is 2024-01-01
+    moods = np.array([MOOD_INDEX[m["sentiment_analysis"]["mood"]] for m in messages], dtype=np.int8)
+    sentiments = np.array([SENTIMENT_INDEX[m["sentiment_analysis"]["sentiment"]] for m in messages], dtype=np.int8)
+    
+    patterns = analyzer.analyze_mood_arrays(days, moods, sentiments)
+    
+    assert patterns == analyzer.analyze_mood_patterns(messages)
+    assert patterns["mood_trend"] == "improving"
+    assert analyzer.analyze_mood_arrays(days[:0], moods[:0], sentiments[:0]) == {}
+
+def test_sentiment_batch_matches_single(analyzer):
+    """Test that batch analysis gives the same results as one text at a time"""
+    texts = [
+        "I'm so happy and excited about this amazing day!",
+        "I'm feeling really sad and upset about everything",
+        "The weather is okay today",
+        "",
+        "Thanks, I love it but I hate waiting 😊"
+    ]
+    
+    assert analyzer.analyze_sentiment_batch(texts) == [analyzer.analyze_sentiment(text) for text in texts]
+    assert analyzer.analyze_sentiment_batch([]) == []